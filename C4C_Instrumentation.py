@@ -0,0 +1,155 @@
+import math
+import random
+import threading
+import time
+
+
+class Histogram:
+    '''
+        Histogram with buckets growing by a factor 2 ** (1 / 4), usable for seconds as well as sizes (bytes, parts)
+        Percentiles are interpolated within their bucket, the error stays well below the 19% bucket width
+    '''
+
+    subdivisions = 4  # buckets per power of 2
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = {}  # index -> count, bucket holds values in (2 ** ((index - 1) / subdivisions), 2 ** (index / subdivisions)]
+
+    def Add(self, value):
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+        index = int(math.ceil(math.log(value, 2) * self.subdivisions)) if value > 0 else None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def Percentile(self, percentile):
+        ''' Value of the percentile (0 - 100), linearly interpolated within its bucket '''
+
+        if self.count == 0:
+            return 0.0
+
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for index in sorted(self.buckets.keys(), key=lambda x: float("-inf") if x is None else x):
+            count = self.buckets[index]
+            if seen + count >= rank:
+                if index is None:
+                    return 0.0
+                lower = max(2.0 ** ((index - 1.0) / self.subdivisions), self.min)
+                upper = min(2.0 ** (float(index) / self.subdivisions), self.max)
+                return lower + (upper - lower) * max(0.0, rank - seen) / count
+            seen += count
+        return self.max
+
+    def Summary(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "average": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.Percentile(50),
+            "p99": self.Percentile(99),
+        }
+
+
+class Instrumentation:
+    '''
+        Process wide metrics & tracing for Odata and SOAP calls, cheap enough to leave always on
+        Histograms are kept per (kind, target, method, phase), ex: ("odata", "QuoteCollection", "GET", "network")
+        Hooks are functions receiving every event as dict (kind, target, method, phase, value), ex: to export traces
+    '''
+
+    hooks = []
+    sampleRate = 0.0  # fraction of calls for which full bodies are logged
+    slowThreshold = None  # seconds, slower calls are always logged with full bodies
+
+    _histograms = {}
+    _counters = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def Configure(environment):
+        ''' Apply optional sampling settings from the config environment '''
+
+        sampleRate = getattr(environment, "WebServiceTrafficSampleRate", None)
+        if sampleRate is not None:
+            Instrumentation.sampleRate = float(sampleRate)
+
+        slowThreshold = getattr(environment, "WebServiceTrafficSlowThreshold", None)
+        if slowThreshold is not None:
+            Instrumentation.slowThreshold = float(slowThreshold)
+
+    @staticmethod
+    def Observe(kind, target, method, phase, value):
+        ''' Add a measurement (seconds, bytes, parts, ...) to its histogram '''
+
+        key = (kind, target, method, phase)
+        with Instrumentation._lock:
+            histogram = Instrumentation._histograms.get(key)
+            if histogram is None:
+                histogram = Instrumentation._histograms[key] = Histogram()
+            histogram.Add(value)
+
+        if Instrumentation.hooks:
+            Instrumentation._Notify({"kind": kind, "target": target, "method": method, "phase": phase, "value": value})
+
+    @staticmethod
+    def Count(name, amount=1):
+        ''' Increment a counter, ex: "odata.csrf.refresh" '''
+
+        with Instrumentation._lock:
+            Instrumentation._counters[name] = Instrumentation._counters.get(name, 0) + amount
+
+        if Instrumentation.hooks:
+            Instrumentation._Notify({"kind": "counter", "target": name, "method": None, "phase": None, "value": amount})
+
+    @staticmethod
+    def _Notify(event):
+        for hook in list(Instrumentation.hooks):
+            try:
+                hook(event)
+            except Exception:
+                with Instrumentation._lock:
+                    Instrumentation._counters["instrumentation.hookErrors"] = Instrumentation._counters.get("instrumentation.hookErrors", 0) + 1
+
+    @staticmethod
+    def Timed(kind, target, method, phase, function):
+        ''' Wrap function to observe the duration of every call '''
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                Instrumentation.Observe(kind, target, method, phase, time.time() - start)
+        return timed
+
+    @staticmethod
+    def ShouldLogBodies(seconds):
+        ''' Sampling decision for logging full request & response bodies '''
+
+        if Instrumentation.slowThreshold is not None and seconds >= Instrumentation.slowThreshold:
+            return True
+        return Instrumentation.sampleRate > 0 and random.random() < Instrumentation.sampleRate
+
+    @staticmethod
+    def GetStats():
+        ''' Counters and histogram summaries, histograms are keyed as "kind target method phase" '''
+
+        with Instrumentation._lock:
+            counters = dict(Instrumentation._counters)
+            histograms = dict((" ".join(str(part) for part in key), histogram.Summary()) for key, histogram in Instrumentation._histograms.items())
+        return {"counters": counters, "histograms": histograms}
+
+    @staticmethod
+    def Reset():
+        with Instrumentation._lock:
+            Instrumentation._histograms = {}
+            Instrumentation._counters = {}
@@ -1,290 +1,1221 @@
-import clr
-clr.AddReference('System.Web')
-
-import System
-from System import Uri
-from System.Net import WebClient
-from System.Web import HttpUtility
-from System.Threading.Tasks import Task
-
-from Helper import Helper
-from Objects import Objects
-
-class OdataRequest:
-    ''' individual request model '''
-
-    class Method:
-        ''' Available methods for odata requests'''
-        GET = "GET"
-        POST = "POST"
-        PATCH = "PATCH"
-        PUT = "PUT"
-        DELETE = "DELETE"
-
-    def __init__(self, method, url, query={}, contentId=None, body=None, contentType="application/json", accept="application/json"):
-        ''' create new request '''
-        self.method = method
-        self.url = url
-        self.query = query
-        self.contentId = contentId
-        self.body = body
-        self.contentType = contentType
-        self.accept = accept
-
-    def getUrl(self):
-        return str(self).split(" ")[1]
-
-    def __str__(self):
-        ''' create string respresentation of individual request '''
-
-        # default to json format for get queries
-        if self.method == OdataRequest.Method.GET and "format" not in self.query.keys():
-            self.query["format"] = "json"
-
-        # request
-        requestUrl = self.url
-        for key in self.query.keys():
-            if self.query.keys()[0] == key:  # is first
-                requestUrl += "?"
-            requestUrl += "${key}={value}".format(key=key, value=HttpUtility.UrlEncode(self.query[key]))
-            if self.query.keys()[-1] != key:  # not last
-                requestUrl += "&"
-        request = " ".join([self.method, requestUrl, "HTTP/1.1"])
-
-        # headers
-        if self.method != OdataRequest.Method.GET:
-            request += "\nContent-Type: " + self.contentType
-        if self.contentId is not None:
-            request += "\nContent-ID: " + self.contentId
-        if self.body is not None:
-            request += "\nContent-Length: " + str(len(self.body))
-        if self.method != OdataRequest.Method.GET:
-            request += "\nAccept: " + self.accept
-
-        # body
-        if self.body is not None:
-            request += "\n\n" + self.body
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from C4C_OdataCore import OdataBatchReader, OdataBatchWriter, OdataChangeset, OdataHeader, OdataJson, OdataRequest, OdataResponsePart, UrlEncode
+from C4C_Instrumentation import Instrumentation
+
+# CLR & CPQ modules (Helper, Objects, System, transport) are imported on first use, keeping the import of this module cheap
+
+class _AwaitableGroup:
+    ''' Awaitable stand-in for multiple tasks (see Odata.Await), results are returned in order of the tasks '''
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+    def GetAwaiter(self):
+        return self
+
+    def GetResult(self):
+        return [task.GetAwaiter().GetResult() for task in self.tasks]
+
+class OdataFuture:
+    ''' Response of a queued change request (see OdataQueue), awaitable using Odata.Await '''
+
+    def __init__(self, queue, request):
+        self.Request = request
+        self.ContentId = request.contentId
+        self._queue = queue
+        self._done = threading.Event()
+        self._response = None
+        self._error = None
+
+    @property
+    def Done(self):
+        return self._done.is_set()
+
+    def _Resolve(self, response=None, error=None):
+        self._response = response
+        self._error = error
+        self._done.set()
+
+    def GetAwaiter(self):
+        return self
+
+    def GetResult(self):
+        ''' Wait for the OdataResponsePart of the request, the queue is flushed first when the request is still buffered '''
+
+        if not self._done.is_set():
+            self._queue._FlushIfPending(self)
+        self._done.wait()
+
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+class OdataQueue:
+    '''
+        Unit of work buffering change requests (POST, PATCH, PUT, DELETE), sent as one $batch changeset per flush
+        A flush happens on Flush(), when leaving the with block and before adding a request to a full buffer (maxSize)
+        Content-IDs are assigned per changeset (1, 2, ...), so a request can refer to an earlier one ("$1").
+        Requests referring to a buffered request are never separated from it (the buffer may grow beyond maxSize),
+        references to a request that is not buffered (already flushed) and duplicate Content-IDs raise ValueError.
+        In Async mode the changeset is sent on a task.
+
+        > with odata.Queue() as queue:
+        >     account = queue.Add(OdataRequest("POST", "CorporateAccountCollection", body=accountJson))
+        >     queue.Add(OdataRequest("POST", "$" + account.ContentId + "/CorporateAccountTeam", body=teamJson))
+        > print(Odata.Await(account).StatusCode)
+    '''
+
+    def __init__(self, odata, maxSize=100):
+        self.odata = odata
+        self.maxSize = maxSize
+        self._requests = []
+        self._futures = []
+        self._contentIds = set()  # Content-IDs of the buffered requests
+        self._inFlight = []  # futures of flushed requests, awaited when leaving the with block
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        ''' Flush & wait for all requests, buffered requests are discarded (and fail) when the block raised '''
+
+        if exceptionType is not None:
+            self._Discard(exception)
+            return False
+
+        self.Flush()
+        self.Wait()
+        return False
+
+    def Add(self, request):
+        ''' Buffer change request, returns its OdataFuture '''
+
+        if request.method == OdataRequest.Method.GET:
+            raise ValueError("GET requests can not be part of a changeset, use Odata.Execute instead")
+
+        reference = request.url[1:].split("/")[0] if request.url.startswith("$") else None
+
+        with self._lock:
+            if reference is not None and reference not in self._contentIds:
+                raise ValueError("'{0}' refers to a request that is not buffered, references only work within the same flush".format(request.url))
+
+            # flush before adding a request to a full buffer, never between a request and the requests referring to it
+            isFull = reference is None and len(self._requests) >= self.maxSize
+            if not isFull and request.contentId in self._contentIds:
+                raise ValueError("Content-ID '{0}' is already used by a buffered request".format(request.contentId))
+            flushed = self._TakeBuffer() if isFull else None
+
+            if request.contentId is None:
+                contentId = len(self._requests) + 1
+                while str(contentId) in self._contentIds:
+                    contentId += 1
+                request.contentId = str(contentId)
+            future = OdataFuture(self, request)
+            self._requests.append(request)
+            self._futures.append(future)
+            self._contentIds.add(request.contentId)
+
+        if flushed is not None:
+            self._SendBuffer(*flushed)
+        return future
+
+    def Flush(self):
+        ''' Send the buffered requests as one changeset '''
+
+        with self._lock:
+            requests, futures = self._TakeBuffer()
+        self._SendBuffer(requests, futures)
+
+    def _TakeBuffer(self):
+        ''' Empty the buffer, returns its (requests, futures), the lock has to be held '''
+
+        requests, futures = self._requests, self._futures
+        self._requests, self._futures, self._contentIds = [], [], set()
+        self._inFlight.extend(futures)
+        return requests, futures
+
+    def _SendBuffer(self, requests, futures):
+
+        if not requests:
+            return
+
+        Instrumentation.Count("odata.queue.flushes")
+        Instrumentation.Observe("odata", "$batch", "POST", "queued", len(requests))
+
+        if self.odata.isAsync:
+            Odata._StartTask(lambda: self._Send(requests, futures))
         else:
-            request += "\n"
-        return request
+            self._Send(requests, futures)
 
-class OdataChangeset:
-    ''' array of requests that make changes (POST, PATCH, ...) '''
+    def Wait(self):
+        ''' Wait until all flushed requests are answered '''
 
-    def __init__(self, changeRequests):
-        ''' Create new changeset '''
-        self.changeRequests = changeRequests
+        with self._lock:
+            futures, self._inFlight = self._inFlight, []
+        for future in futures:
+            future._done.wait()
 
-    def __str__(self):
-        ''' create string representation of changeset request '''
+    def _FlushIfPending(self, future):
 
-        fullRequest, boundary = Odata._combineRequests("changeset", self.changeRequests)
-        rawChangeset = "Content-Type: multipart/mixed; boundary={0}\n\n".format(boundary)
-        rawChangeset += fullRequest
+        with self._lock:
+            isPending = future in self._futures
+        if isPending:
+            self.Flush()
 
-        return rawChangeset
+    def _Discard(self, exception):
+
+        with self._lock:
+            futures = self._futures
+            self._requests, self._futures, self._contentIds = [], [], set()
+        for future in futures:
+            future._Resolve(error=exception)
+
+    def _Send(self, requests, futures):
+        ''' Send changeset and resolve every future with the response of its own part '''
+
+        try:
+            responses = Odata._mergeBatchResponses(self.odata._SendBatch([OdataChangeset(requests)], False))
+        except Exception as e:
+            for future in futures:
+                future._Resolve(error=e)
+            return
+
+        changesetResponse = responses[0] if responses else None
+        if isinstance(changesetResponse, list) and len(changesetResponse) == len(futures):
+            for future, response in zip(futures, changesetResponse):
+                future._Resolve(response)
+        else:  # c4c answers a failed changeset with a single error response for all of its requests
+            for future in futures:
+                future._Resolve(changesetResponse)
+
+class OdataCsrfCache:
+    ''' Process wide store of csrf tokens & session cookies, shared by all Odata instances for the same SAPID & user '''
+
+    ttl = 1200  # seconds, stays below the default C4C session timeout
+
+    _entries = {}
+    _locks = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _lockFor(key):
+        with OdataCsrfCache._lock:
+            return OdataCsrfCache._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def Get(sapId, username, fetch):
+        ''' Get csrf token & cookies, fetch is only called when there is no valid entry in the cache '''
+
+        csrf = OdataCsrfCache._entries.get((sapId, username))
+        if csrf is not None and csrf.expires > time.time():
+            return csrf
+
+        return OdataCsrfCache.Refresh(sapId, username, fetch, csrf)
+
+    @staticmethod
+    def Refresh(sapId, username, fetch, stale=None):
+        ''' Refresh the entry (single flight): concurrent callers holding the same stale entry share one fetch '''
+
+        key = (sapId, username)
+        with OdataCsrfCache._lockFor(key):
+            csrf = OdataCsrfCache._entries.get(key)
+            if csrf is not None and csrf is not stale and csrf.expires > time.time():
+                return csrf  # already refreshed by another caller
+
+            csrf = fetch()
+            csrf.expires = time.time() + OdataCsrfCache.ttl
+            OdataCsrfCache._entries[key] = csrf
+            return csrf
+
+    @staticmethod
+    def Invalidate(sapId=None, username=None):
+        ''' Remove cached entries, all entries when no SAPID is provided '''
+
+        with OdataCsrfCache._lock:
+            for key in list(OdataCsrfCache._entries.keys()):
+                if sapId is None or key == (sapId, username):
+                    del OdataCsrfCache._entries[key]
+
+class _Flight:
+    ''' Result of a request executed synchronously, awaited by identical requests (see OdataInFlight) '''
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _Resolve(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def GetAwaiter(self):
+        return self
+
+    def GetResult(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class OdataInFlight:
+    '''
+        Process wide single-flight registry for GET requests, keyed on the canonical url (see OdataResponseCache.GetKey)
+        While a request is in flight, identical requests share its task and raw response body instead of sending their own
+        Every caller parses the body itself, so parsed results are never shared between callers
+        Once a write to an entity set is answered (see Invalidate), flights of that entity set started before are not joined
+    '''
+
+    _flights = {}  # key -> (task (Async) or _Flight (Sync), entity set, generation when started, token) of the request in flight
+    _generation = 0  # incremented by every Invalidate
+    _writes = {}  # entity set -> generation of its last answered write
+    _lock = threading.Lock()
+    stats = {"executed": 0, "coalesced": 0}
+
+    @staticmethod
+    def Start(key, execute, entitySet=None):
+        ''' Start execute on a task, or return the task of the identical request in flight '''
+
+        with OdataInFlight._lock:
+            flight = OdataInFlight._Join(key, entitySet)
+            if flight is None:
+                OdataInFlight.stats["executed"] += 1
+                token = object()
+                task = Odata._StartTask(lambda: OdataInFlight._Complete(key, token, execute))
+                OdataInFlight._flights[key] = (task, entitySet, OdataInFlight._generation, token)  # registered before the task can complete, it removes itself under the lock
+                return task
+            OdataInFlight.stats["coalesced"] += 1
+
+        Instrumentation.Count("odata.inflight.coalesced")
+        if isinstance(flight, _Flight):  # joined a synchronous request, wait for it on a task
+            return Odata._StartTask(flight.GetResult)
+        return flight
+
+    @staticmethod
+    def Execute(key, execute, entitySet=None):
+        ''' Execute in the current thread, or wait for the result of the identical request in flight '''
+
+        with OdataInFlight._lock:
+            flight = OdataInFlight._Join(key, entitySet)
+            if flight is None:
+                OdataInFlight.stats["executed"] += 1
+                flight = _Flight()
+                OdataInFlight._flights[key] = (flight, entitySet, OdataInFlight._generation, flight)
+                isLeader = True
+            else:
+                OdataInFlight.stats["coalesced"] += 1
+                isLeader = False
+
+        if not isLeader:
+            Instrumentation.Count("odata.inflight.coalesced")
+            return flight.GetAwaiter().GetResult()
+
+        try:
+            result = OdataInFlight._Complete(key, flight, execute)
+        except Exception as e:
+            flight._Resolve(error=e)
+            raise
+        flight._Resolve(result)
+        return result
+
+    @staticmethod
+    def Invalidate(entitySet):
+        ''' Call once a write to the entity set is answered, later callers do not join flights started before '''
+
+        with OdataInFlight._lock:
+            OdataInFlight._generation += 1
+            OdataInFlight._writes[entitySet] = OdataInFlight._generation
+
+    @staticmethod
+    def _Join(key, entitySet):
+        ''' Flight in progress for the key, None when there is none or it may have missed a write, the lock has to be held '''
+
+        registered = OdataInFlight._flights.get(key)
+        if registered is None:
+            return None
+        flight, _, generation, _ = registered
+        if OdataInFlight._writes.get(entitySet, 0) > generation:
+            return None  # started before a write to the entity set was answered, the new flight replaces it
+        return flight
+
+    @staticmethod
+    def _Complete(key, token, execute):
+        try:
+            return execute()
+        finally:
+            with OdataInFlight._lock:
+                registered = OdataInFlight._flights.get(key)
+                if registered is not None and registered[3] is token:  # not replaced by a flight started after a write
+                    del OdataInFlight._flights[key]
+
+    @staticmethod
+    def GetStats():
+        with OdataInFlight._lock:
+            stats = dict(OdataInFlight.stats)
+            stats["inFlight"] = len(OdataInFlight._flights)
+        return stats
+
+class OdataRateLimiter:
+    '''
+        Adaptive token bucket pacing the requests to a C4C tenant (opt-in, see Odata), shared by all instances per service url
+        The rate grows slowly while responses are fast, it is halved on throttling (429/503) and reduced when latency increases
+        A Retry-After of c4c pauses the bucket, so no request is sent before the tenant accepts requests again
+    '''
+
+    minRate = 0.5  # requests per second
+    maxRate = 100.0
+    increase = 1.0  # requests per second added per second of fast responses
+    decrease = 0.5  # factor applied on throttling
+    latencyFactor = 2.0  # responses slower than latencyFactor * the usual latency (per target) reduce the rate
+    latencyDecrease = 0.9
+
+    _limiters = {}
+    _limitersLock = threading.Lock()
+
+    def __init__(self, rate):
+        self.rate = max(self.minRate, min(self.maxRate, float(rate)))
+        self._tokens = 1.0
+        self._updated = time.time()
+        self._pausedUntil = 0.0
+        self._latency = {}  # target -> (average, usual) latency in seconds
+        self._lock = threading.Lock()
+        self.stats = {"waits": 0, "waitSeconds": 0.0, "throttled": 0, "slow": 0}
+
+    @staticmethod
+    def Shared(serviceUrl, rate):
+        ''' Limiter of the service url, created with the initial rate on first use '''
+
+        with OdataRateLimiter._limitersLock:
+            limiter = OdataRateLimiter._limiters.get(serviceUrl)
+            if limiter is None:
+                limiter = OdataRateLimiter._limiters[serviceUrl] = OdataRateLimiter(rate)
+            return limiter
+
+    def Acquire(self):
+        ''' Wait for a token, returns the seconds waited '''
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                if now >= self._pausedUntil:
+                    burst = max(1.0, self.rate)  # at most one second worth of requests at once
+                    self._tokens = min(burst, self._tokens + max(0.0, now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        if waited > 0:
+                            self.stats["waits"] += 1
+                            self.stats["waitSeconds"] += waited
+                        return waited
+                    wait = (1.0 - self._tokens) / self.rate
+                else:
+                    wait = self._pausedUntil - now
+            time.sleep(wait)
+            waited += wait
+
+    def Observe(self, target, statusCode, seconds, retryAfter=None):
+        ''' Tune the rate with the outcome of a request, retryAfter (seconds) pauses the bucket '''
+
+        with self._lock:
+            if statusCode in (429, 503):
+                self.stats["throttled"] += 1
+                self.rate = max(self.minRate, self.rate * self.decrease)
+                if retryAfter is not None:
+                    self._pausedUntil = max(self._pausedUntil, time.time() + retryAfter)
+                    self._tokens, self._updated = 0.0, self._pausedUntil
+                return
+
+            average, usual = self._latency.get(target, (seconds, seconds))
+            average = 0.8 * average + 0.2 * seconds
+            usual = min(usual * 1.01, average)  # slowly forgets a fast outlier
+            self._latency[target] = (average, usual)
+
+            if average > self.latencyFactor * usual:
+                self.stats["slow"] += 1
+                self.rate = max(self.minRate, self.rate * self.latencyDecrease)
+            else:
+                self.rate = min(self.maxRate, self.rate + self.increase / self.rate)
+
+    def GetStats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["rate"] = self.rate
+        return stats
+
+class OdataResponseCache:
+    '''
+        LRU cache of GET responses (parsed results) with a TTL per entry (opt-in, see Odata)
+        Expired entries with an ETag are revalidated using If-None-Match, a 304 skips both download and json parsing
+        Cached results are shared between callers and should not be modified
+        Writes invalidate their entity set once answered, responses of GET requests started before that are not stored (see Generation)
+    '''
+
+    maxEntries = 500
+
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, maxEntries=None):
+
+        if maxEntries is not None:
+            self.maxEntries = maxEntries
+
+        self._entries = OrderedDict()  # key -> entry, least recently used first
+        self._generation = 0  # incremented by every Invalidate
+        self._invalidated = {}  # entity set (None: all) -> generation of its last invalidation
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def Shared():
+        ''' Process wide cache instance '''
+
+        with OdataResponseCache._sharedLock:
+            if OdataResponseCache._shared is None:
+                OdataResponseCache._shared = OdataResponseCache()
+            return OdataResponseCache._shared
+
+    @staticmethod
+    def GetEntitySet(url):
+        ''' ex: QuoteCollection for "QuoteCollection('1')/QuoteItem?$top=1" '''
+
+        return url.split("?")[0].split("/")[0].split("(")[0]
+
+    @staticmethod
+    def GetKey(request):
+        ''' canonical request: method, entity set path and query sorted by key, values are encoded as in the url '''
+
+        query = dict(request.query)
+        if request.method == OdataRequest.Method.GET and "format" not in query:
+            query["format"] = "json"
+        return request.method + " " + request.url + "?" + "&".join("{0}={1}".format(key, UrlEncode(query[key])) for key in sorted(query.keys()))
+
+    def Get(self, key):
+        ''' Returns entry (Result, ETag, Expires, EntitySet) or None, the entry may be expired '''
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry  # most recently used
+            return entry
+
+    def Generation(self):
+        ''' Take before sending a GET request and pass to Put, the response is dropped when its entity set was invalidated since '''
+
+        with self._lock:
+            return self._generation
+
+    def Put(self, key, entitySet, result, etag, ttl, generation=None):
+        ''' Store and return the entry, it is returned but not stored when the entity set was invalidated since generation '''
+
+        from Objects import Objects
+
+        entry = Objects.Dynamic()
+        entry.EntitySet = entitySet
+        entry.Result = result
+        entry.ETag = etag
+        entry.Expires = time.time() + ttl
+
+        with self._lock:
+            if generation is not None and max(self._invalidated.get(entitySet, 0), self._invalidated.get(None, 0)) > generation:
+                return entry  # a write was answered while this response was in flight, it may be stale
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            evictions = 0
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                evictions += 1
+            self.stats["evictions"] += evictions
+
+        if evictions > 0:
+            Instrumentation.Count("odata.cache.evictions", evictions)
+        return entry
+
+    def Invalidate(self, entitySet=None):
+        ''' Remove entries of an entity set, all entries when no entity set is provided '''
+
+        with self._lock:
+            self._generation += 1
+            self._invalidated[entitySet] = self._generation
+            keys = [key for key, entry in self._entries.items() if entitySet is None or entry.EntitySet == entitySet]
+            for key in keys:
+                del self._entries[key]
+            self.stats["invalidations"] += len(keys)
+
+        if len(keys) > 0:
+            Instrumentation.Count("odata.cache.invalidations", len(keys))
+
+    def Count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        Instrumentation.Count("odata.cache." + name)
+
+    def GetStats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        return stats
 
 class Odata:
     ''' Call C4C web services (for easy debugging: use fiddler) '''
 
-    def __init__(self, config):
-        ''' Create new Odata webservice helper '''
+    retryBaseDelay = 0.5  # seconds, doubled for every retry of a throttled request
+    retryMaxDelay = 30.0
+
+    def __init__(self, config, transport=None, responseCache=None):
+        '''
+            Create new Odata webservice helper, transport defaults to the shared keep-alive OdataTransport
+            GET responses are cached when OdataResponseCacheTtl (seconds) is configured, in the shared OdataResponseCache by default
+        '''
 
         self.username = config.environment.OdataServiceUsername
         self.password = config.environment.OdataServicePassword
         self.sapId = config.environment.SAPID
 
+        from Helper import Helper
+
         self.odataCredentials = Helper.Python.EncodeCredentialsForBasicAuthentication(self.username, self.password)
+        self.defaultHeaders = {"Authorization": "Basic " + self.odataCredentials}  # precomputed, sent with every request
+
+        # optional (opt-in) compression: gzip/deflate responses, gzip request bodies from OdataCompressRequestsAbove bytes
+        if getattr(config.environment, "OdataCompression", None):
+            self.defaultHeaders["Accept-Encoding"] = "gzip, deflate"
+        self.compressRequestsAbove = getattr(config.environment, "OdataCompressRequestsAbove", None)
 
-        self.csrf = self._getCsrf()
+        defaultServiceUrl = "https://my{0}.crm.ondemand.com/sap/c4c/odata/v1/c4codataapi/".format(self.sapId)
+        self.serviceUrl = getattr(config.environment, "OdataServiceUrl", None) or defaultServiceUrl
+
+        if transport is None:
+            from C4C_OdataTransport import OdataTransport
+
+            transport = OdataTransport.Shared()
+            maxConnections = getattr(config.environment, "OdataMaxConnectionsPerHost", None)
+            if maxConnections is not None:
+                transport.Configure(maxConnections)
+        self.transport = transport
+
+        self._GetCsrf()  # make sure a session exists (shared with other instances through OdataCsrfCache)
         self.logging = config.environment.WebServiceTrafficLogging
+        Instrumentation.Configure(config.environment)  # sampled body logging when traffic logging is off
 
         self.isAsync = config.environment.OdataMethod.upper() == "Async".upper()
 
-    def _GetExecutor(self, contentType, executionType, methodType, acceptType=None):
-
-        client = WebClient()
-        client.Headers.Add("Authorization", "Basic " + self.odataCredentials)
-        client.Headers.Add("x-csrf-token", self.csrf.token)
-        client.Headers.Add("Cookie", ";".join(self.csrf.cookies))
-        client.Headers.Add("Content-Type", contentType)
+        # optional limits for a single $batch request, larger batches are split in multiple wire batches
+        maxParts = getattr(config.environment, "OdataBatchMaxParts", None)
+        maxBytes = getattr(config.environment, "OdataBatchMaxBytes", None)
+        self.batchWriter = OdataBatchWriter(maxParts, maxBytes)
+
+        # optional (opt-in) cache for GET responses
+        self.responseCacheTtl = getattr(config.environment, "OdataResponseCacheTtl", None)
+        if responseCache is None and self.responseCacheTtl is not None:
+            responseCache = OdataResponseCache.Shared()
+            maxEntries = getattr(config.environment, "OdataResponseCacheSize", None)
+            if maxEntries is not None:
+                responseCache.maxEntries = maxEntries
+        self.responseCache = responseCache
+
+        self.queueMaxSize = getattr(config.environment, "OdataQueueMaxSize", None) or 100
+
+        # identical GET requests in flight share one request & raw body, each caller parses it (see OdataInFlight), on unless disabled
+        coalesceRequests = getattr(config.environment, "OdataCoalesceRequests", None)
+        self.coalesceRequests = True if coalesceRequests is None else bool(coalesceRequests)
+
+        # optional (opt-in) throttling: adaptive rate limit (initial requests per second), retries of 429/503 responses
+        rateLimit = getattr(config.environment, "OdataRateLimit", None)
+        self.rateLimiter = OdataRateLimiter.Shared(self.serviceUrl, rateLimit) if rateLimit is not None else None
+        self.maxRetries = int(getattr(config.environment, "OdataMaxRetries", None) or 0)
+        self.retryBaseDelay = float(getattr(config.environment, "OdataRetryBaseDelay", None) or self.retryBaseDelay)
+        self.bisectChangesets = bool(getattr(config.environment, "OdataBisectChangesets", None))
+
+    def _GetHeaders(self, csrf, contentType, acceptType=None, extraHeaders=None):
+
+        headers = dict(self.defaultHeaders)
+        headers.update(csrf.headers)
+        headers["Content-Type"] = contentType
         if acceptType is not None:
-            client.Headers.Add("Accept", acceptType)
+            headers["Accept"] = acceptType
+        if extraHeaders is not None:
+            headers.update(extraHeaders)
+
+        return headers
+
+    def _ExecuteRaw(self, url, body, method, contentType, acceptType=None, isAsync=None):
+        ''' Execute request, in Async mode a task is returned that can be awaited using Odata.Await '''
+
+        isAsync = self.isAsync if isAsync is None else isAsync
+        if isAsync:
+            return Odata._StartTask(lambda: self._ExecuteWithCsrf(url, body, method, contentType, acceptType))
+
+        return self._ExecuteWithCsrf(url, body, method, contentType, acceptType)
+
+    @staticmethod
+    def _StartTask(function):
+        from System import Func
+        from System.Threading.Tasks import Task
 
-        actions = {
-            "Sync": {
-                "Download": client.DownloadString,
-                "Upload": client.UploadString
-            },
-            "Async": {
-                "Download": client.DownloadStringTaskAsync,
-                "Upload": client.UploadStringTaskAsync
-            }
-        }
+        return Task.Factory.StartNew(Func[object](function))
 
-        return actions[executionType][methodType]
+    def _ExecuteWithCsrf(self, url, body, method, contentType, acceptType):
+        ''' Execute request and return the body, http errors are raised '''
 
-    def _GetExecutionType(self):
-        return "Async" if self.isAsync else "Sync"
+        response = self._ExecuteResponse(url, body, method, contentType, acceptType)
 
-    def _GetMethodType(self, method):
-        return "Download" if method == "GET" else "Upload"
+        if response.Error is not None:
+            raise response.Error
 
-    def _ExecuteRaw(self, action, url, body, method):
+        return response.Body
+
+    def _ExecuteResponse(self, url, body, method, contentType, acceptType, extraHeaders=None, isStreamed=False):
+        '''
+            Execute request and return the response object, throttled requests (429/503) are retried up to maxRetries times
+            isStreamed: a successful response has a Reader instead of a Body and has to be closed (see OdataTransport.Open)
+        '''
+
+        response = self._ExecuteReplayingCsrf(url, body, method, contentType, acceptType, extraHeaders, isStreamed)
+
+        attempt = 0
+        while Odata._isThrottled(response) and attempt < self.maxRetries:
+            delay = self._GetRetryDelay(response, attempt)
+            Log.Write("c4c is throttling requests ({0}), retrying in {1:.2f}s".format(response.StatusCode, delay))
+            Instrumentation.Count("odata.retries")
+            time.sleep(delay)
+            attempt += 1
+            response = self._ExecuteReplayingCsrf(url, body, method, contentType, acceptType, extraHeaders, isStreamed)
+
+        return response
+
+    def _ExecuteReplayingCsrf(self, url, body, method, contentType, acceptType, extraHeaders=None, isStreamed=False):
+        ''' Execute request and return the response object, when c4c rejects the csrf token it is refreshed once and the request is replayed '''
+
+        csrf = self._GetCsrf()
+        response = self._ExecuteOnce(csrf, url, body, method, contentType, acceptType, extraHeaders, isStreamed)
+
+        if Odata._isCsrfFailure(response):
+            Log.Write("csrf token validation failed, refreshing csrf token and replaying request")
+            csrf = OdataCsrfCache.Refresh(self.sapId, self.username, self._fetchCsrf, csrf)
+            response = self._ExecuteOnce(csrf, url, body, method, contentType, acceptType, extraHeaders, isStreamed)
+
+        return response
+
+    def _ExecuteOnce(self, csrf, url, body, method, contentType, acceptType, extraHeaders=None, isStreamed=False):
+
+        headers = self._GetHeaders(csrf, contentType, acceptType, extraHeaders)
+        if body is not None and self.compressRequestsAbove is not None and len(body) >= self.compressRequestsAbove:
+            headers["Content-Encoding"] = "gzip"  # compressed by the transport
 
         if self.logging:
             Log.Write("--ODATA REQUEST--\n\n" + str(url) + "\n\n" + str(body))
 
-        args = [Uri(url)] if self._GetMethodType(method) == "Download" else [Uri(url), method, body]
+        target = self._GetTarget(url)
+        if self.rateLimiter is not None:
+            waited = self.rateLimiter.Acquire()
+            if waited > 0:
+                Instrumentation.Observe("odata", target, method, "rateLimit", waited)
+
+        from Helper import Helper
+
+        send = self.transport.Open if isStreamed else self.transport.Send
+        response, duration = Helper.Utility.ExecuteAndTimeAction(send, method, url, headers, body)
 
-        response, duration = Helper.Utility.ExecuteAndTimeAction(action, *args)
+        if self.rateLimiter is not None:
+            self.rateLimiter.Observe(target, response.StatusCode, duration, Odata._GetRetryAfter(response))
 
+        Instrumentation.Observe("odata", target, method, "network", duration)
+        Instrumentation.Observe("odata", target, method, "bytesOut", len(body) if body is not None else 0)
+        if response.Body is not None:  # None when streamed
+            Instrumentation.Observe("odata", target, method, "bytesIn", len(response.Body))
+        if getattr(response, "BytesReceived", None) is not None:  # bytes on the wire, less than bytesIn when compressed
+            Instrumentation.Observe("odata", target, method, "wireBytesOut", getattr(response, "BytesSent", 0))
+            Instrumentation.Observe("odata", target, method, "wireBytesIn", response.BytesReceived)
+
+        responseBody = response.Body if response.Body is not None else "(streamed)"
         if self.logging:
-            Log.Write("--ODATA RESPONSE [{0}s]--\n\n{1}".format(str(duration), response))
+            Log.Write("--ODATA RESPONSE [{0}s]--\n\n{1}".format(str(duration), responseBody))
+        elif Instrumentation.ShouldLogBodies(duration):
+            Log.Write("--ODATA REQUEST (sampled)--\n\n" + str(url) + "\n\n" + str(body))
+            Log.Write("--ODATA RESPONSE (sampled) [{0}s]--\n\n{1}".format(str(duration), responseBody))
 
         return response
 
+    def _GetTarget(self, url):
+        ''' Entity set (or $batch) of the url, used to group metrics '''
+
+        relativeUrl = url[len(self.serviceUrl):] if url.startswith(self.serviceUrl) else url
+        return OdataResponseCache.GetEntitySet(relativeUrl)
+
+    @staticmethod
+    def _isThrottled(response):
+        return response.StatusCode in (429, 503)
+
+    @staticmethod
+    def _GetRetryAfter(response):
+        ''' Retry-After header in seconds, None when missing or a http date '''
+
+        try:
+            return float(response.Headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    def _GetRetryDelay(self, response, attempt):
+        ''' Retry-After of c4c when provided, exponential backoff otherwise, both with random jitter to spread the retries of all callers '''
+
+        retryAfter = Odata._GetRetryAfter(response)
+        if retryAfter is not None:
+            return retryAfter + random.uniform(0, self.retryBaseDelay)
+        return random.uniform(0, min(self.retryMaxDelay, self.retryBaseDelay * 2 ** attempt))
+
+    @staticmethod
+    def _isCsrfFailure(response):
+        ''' c4c answers with 403 and header "x-csrf-token: Required" when the token is invalid or expired '''
+
+        return response.StatusCode == 403 and response.Headers.get("x-csrf-token", "").lower() == "required"
+
     def Execute(self, request):
+        '''
+            Sync: returns the parsed response
+            Async: returns (task, parser), the task returns the raw response body, parse it with the parser (Odata._parseJson)
+            With a response cache, the task returns the cached parsed result and the parser returns it as is
+            Identical GET requests in flight share one wire request (OdataCoalesceRequests), GET responses may come from the cache
+        '''
 
-        baseUrl="https://my{0}.crm.ondemand.com/sap/c4c/odata/v1/c4codataapi/{1}"
+        if self.isAsync is False:
+            return self._ExecuteParsed(request)
 
-        executionType = self._GetExecutionType()
-        methodType = self._GetMethodType(request.method)
-        rawRequest = request.getUrl()
-        url = baseUrl.format(self.sapId, rawRequest)
+        if self._IsCacheable(request):  # hits & 304 responses are not parsed again
+            return (Odata._StartTask(lambda: self._GetCacheEntry(request).Result), lambda result: result)
 
-        action = self._GetExecutor(request.contentType, executionType, methodType, request.accept)
+        parse = Odata._TimedParser(request, Odata._parseJson)
+        if self._IsCoalesced(request):
+            return (OdataInFlight.Start(self._GetRequestKey(request), lambda: self._SendRequestBody(request), OdataResponseCache.GetEntitySet(request.url)), parse)
 
-        response = self._ExecuteRaw(action, url, request.body, request.method)
+        return (Odata._StartTask(lambda: self._ExecuteBody(request)), parse)
 
-        return Odata._parseJson(response) if self.isAsync is False else (response, Odata._parseJson)
+    def _ExecuteParsed(self, request):
+        ''' Execute request synchronously and return the parsed response, a cached response is returned as is '''
 
-    def ExecuteBatch(self, requests):
-        ''' Execute requests in batch '''
+        if self._IsCacheable(request):
+            return self._GetCacheEntry(request).Result
 
-        for changeSet in requests:
-            if isinstance(changeSet, OdataChangeset):
-                for i, req in enumerate(changeSet.changeRequests):
-                    if req.contentId is None:
-                        req.contentId = str(i)
+        return Odata._TimedParser(request, Odata._parseJson)(self._ExecuteBody(request))
 
-        fullRequest, boundary = Odata._combineRequests("batch", requests)
+    def _ExecuteBody(self, request):
+        ''' Execute request synchronously and return the raw response body, identical GET requests in flight are coalesced '''
 
-        contentType = "multipart/mixed; boundary=" + boundary
-        executionType = self._GetExecutionType()
-        methodType = self._GetMethodType("POST")
-        action = self._GetExecutor(contentType, executionType, methodType)
+        if self._IsCoalesced(request):
+            return OdataInFlight.Execute(self._GetRequestKey(request), lambda: self._SendRequestBody(request), OdataResponseCache.GetEntitySet(request.url))
 
-        baseUrl = "https://my{0}.crm.ondemand.com/sap/c4c/odata/v1/c4codataapi/$batch"
-        url = baseUrl.format(self.sapId)
-        response = self._ExecuteRaw(action, url, fullRequest, "POST")
+        return self._SendRequestBody(request)
 
-        return self._parseBatchResponse(response) if self.isAsync is False else (response, Odata._parseBatchResponse)
+    @staticmethod
+    def _TimedParser(request, parse):
+        return Instrumentation.Timed("odata", OdataResponseCache.GetEntitySet(request.url), request.method, "parse", parse)
+
+    def _IsCoalesced(self, request):
+        return self.coalesceRequests and request.method == OdataRequest.Method.GET
+
+    def _GetRequestKey(self, request):
+        return (self.serviceUrl, self.username, OdataResponseCache.GetKey(request))
+
+    def _IsCacheable(self, request):
+        return self.responseCache is not None and request.method == OdataRequest.Method.GET
+
+    def _GetCacheEntry(self, request):
+        ''' Return a fresh cache entry, or (re)validate the entry with c4c '''
+
+        key = self._GetRequestKey(request)
+        entry = self.responseCache.Get(key)
+        if entry is not None and entry.Expires > time.time():
+            self.responseCache.Count("hits")
+            return entry
+
+        if self._IsCoalesced(request):  # flights of entries are kept apart from flights of raw bodies
+            return OdataInFlight.Execute(key + ("cache",), lambda: self._FetchCacheEntry(request, key, entry), OdataResponseCache.GetEntitySet(request.url))
+        return self._FetchCacheEntry(request, key, entry)
+
+    def _FetchCacheEntry(self, request, key, entry):
+        ''' Download the response, or revalidate the expired entry (If-None-Match), and store it '''
+
+        generation = self.responseCache.Generation()
+        extraHeaders = {"If-None-Match": entry.ETag} if entry is not None and entry.ETag else None
+        url = self.serviceUrl + request.getUrl()
+        response = self._ExecuteResponse(url, None, request.method, request.contentType, request.accept, extraHeaders)
+
+        entitySet = OdataResponseCache.GetEntitySet(request.url)
+        if response.StatusCode == 304 and entry is not None:
+            self.responseCache.Count("revalidations")
+            return self.responseCache.Put(key, entitySet, entry.Result, entry.ETag, self.responseCacheTtl, generation)
+
+        if response.Error is not None:
+            raise response.Error
+
+        self.responseCache.Count("misses")
+        result = Odata._TimedParser(request, Odata._parseJson)(response.Body)
+        return self.responseCache.Put(key, entitySet, result, response.Headers.get("etag"), self.responseCacheTtl, generation)
+
+    def _SendRequestBody(self, request):
+        ''' Send request synchronously and return the raw body, cached responses of a changed entity set are removed once answered '''
+
+        try:
+            return self._SendRequest(request, False)
+        finally:
+            self._InvalidateCache([request])
+
+    def _InvalidateCache(self, requests):
+        '''
+            Call once the requests are answered: removes cached responses of the entity sets changed by the requests
+            (including requests in changesets) and keeps later GET requests from joining flights started before (see OdataInFlight)
+        '''
+
+        for req in requests:
+            changeRequests = req.changeRequests if isinstance(req, OdataChangeset) else [req]
+            for changeRequest in changeRequests:
+                if changeRequest.method != OdataRequest.Method.GET:
+                    entitySet = OdataResponseCache.GetEntitySet(changeRequest.url)
+                    OdataInFlight.Invalidate(entitySet)
+                    if self.responseCache is not None:
+                        self.responseCache.Invalidate(entitySet)
+
+    def _SendRequest(self, request, isAsync):
+
+        start = time.time()
+        url = self.serviceUrl + request.getUrl()
+        Instrumentation.Observe("odata", OdataResponseCache.GetEntitySet(request.url), request.method, "serialize", time.time() - start)
+
+        return self._ExecuteRaw(url, request.body, request.method, request.contentType, request.accept, isAsync)
+
+    def Iterate(self, request, pageSize=None, prefetch=False):
+        '''
+            Iterate all entities of a GET collection request, following server-driven paging (d.__next / $skiptoken)
+            With pageSize, windows are requested using $top & $skip until a window is not full
+            c4c caps its pages (1000 entities), so a window larger than the cap is received as several pages linked by __next
+            With prefetch, the next page is already requested (Async executor) while the current page is consumed
+            Only one page (two when prefetching) is kept in memory
+        '''
+
+        skip = int(request.query.get("skip", 0))
+        received = 0  # entities received in the current $top window
+        page = self._StartPage(self._GetPageUrl(request, pageSize, skip), prefetch)
+
+        while page is not None:
+            entities, nextLink = page()
+            received += len(entities)
+
+            if nextLink is not None and (pageSize is None or received < pageSize):
+                page = self._StartPage(self._GetNextLinkUrl(nextLink), prefetch)
+            elif pageSize is not None and received >= pageSize:
+                skip += pageSize
+                received = 0
+                page = self._StartPage(self._GetPageUrl(request, pageSize, skip), prefetch)
+            else:
+                page = None
 
-    def _getCsrf(self):
-        ''' Get csrf token from c4c '''
+            for entity in entities:
+                yield entity
 
-        Log.Write("reloading csrf token")
+    def _GetPageUrl(self, request, pageSize, skip):
 
-        client = WebClient()
-        client.Headers.Add("Authorization", "Basic " + self.odataCredentials)
-        client.Headers.Add("x-csrf-token", "fetch")
-        client.Headers.Add("Content-Type", "application/json")
-        result = client.DownloadString("https://my{0}.crm.ondemand.com/sap/c4c/odata/v1/c4codataapi/$metadata".format(self.sapId))
+        if pageSize is None:
+            return self.serviceUrl + request.getUrl()
 
-        csrf = Objects.Dynamic()
-        csrf.token = client.ResponseHeaders["x-csrf-token"]
-        csrf.cookies = client.ResponseHeaders["set-cookie"].split(",")
-        return csrf
+        return self.serviceUrl + request.withQuery(top=str(pageSize), skip=str(skip)).getUrl()
+
+    def _GetNextLinkUrl(self, nextLink):
+        ''' next link is absolute in c4c, but may be relative to the service root '''
+
+        url = nextLink if nextLink.startswith("http") else self.serviceUrl + nextLink
+        if "$format=" not in url:
+            url += ("&" if "?" in url else "?") + "$format=json"
+        return url
+
+    def _StartPage(self, url, prefetch):
+        ''' Returns a function returning (entities, next link), the request is started immediately when prefetching '''
+
+        if prefetch:
+            task = self._ExecuteRaw(url, None, "GET", "application/json", "application/json", isAsync=True)
+            return lambda: Odata._parseJsonPage(Odata.Await(task))
+
+        return lambda: Odata._parseJsonPage(self._ExecuteRaw(url, None, "GET", "application/json", "application/json", isAsync=False))
+
+    def Queue(self, maxSize=None):
+        ''' Unit of work sending change requests as $batch changesets, see OdataQueue (default size: OdataQueueMaxSize or 100) '''
+
+        return OdataQueue(self, maxSize or self.queueMaxSize)
+
+    def ExecuteBatch(self, requests, bodyFilter=None, bisect=None):
+        '''
+            Execute requests in batch, split in multiple batches when exceeding the configured limits
+            Bodies are deserialized on first access, bodyFilter (part -> bool) can skip them entirely
+            ex: ExecuteBatch(requests, OdataResponsePart.ExcludeStatus(201, 204))
+
+            With bisect (default: OdataBisectChangesets) a failed changeset is split in halves that are resubmitted
+            until the failing requests are isolated, only those get the error response. Changesets are no longer atomic
+            then, changesets referring to Content-IDs ("$1") are never bisected.
+        '''
+
+        responses = self._SendBatch(requests, self.isAsync)
+        bisect = self.bisectChangesets if bisect is None else bisect
+
+        if len(responses) == 1:
+            parse = Instrumentation.Timed("odata", "$batch", "POST", "parse", lambda response: Odata._parseBatchResponse(response, bodyFilter))
+            pending = responses[0]
+        else:  # merge results of all wire batches, in original order
+            parse = Instrumentation.Timed("odata", "$batch", "POST", "parse", lambda batchResponses: Odata._mergeBatchResponses(batchResponses, bodyFilter))
+            pending = _AwaitableGroup(responses) if self.isAsync else responses
+
+        complete = parse
+        if bisect:
+            complete = lambda response: self._BisectChangesets(requests, parse(response), bodyFilter)
+
+        return complete(pending) if self.isAsync is False else (pending, complete)
+
+    def _BisectChangesets(self, requests, responses, bodyFilter):
+        ''' Replace the error response of failed changesets by the responses of its requests (see ExecuteBatch) '''
+
+        for i, (request, response) in enumerate(zip(requests, responses)):
+            isFailure = isinstance(response, OdataResponsePart) and response.StatusCode >= 400
+            if isinstance(request, OdataChangeset) and isFailure and Odata._CanBisect(request):
+                responses[i] = self._Bisect(request.changeRequests, response, bodyFilter)
+        return responses
 
     @staticmethod
-    def _combineRequests(type, requests):
-        ''' generate boundary and use it to create a odata compatible string representation for batching '''
+    def _CanBisect(changeset):
+        return len(changeset.changeRequests) > 1 and not any(request.url.startswith("$") for request in changeset.changeRequests)
 
-        def format(req):
+    def _Bisect(self, changeRequests, failure, bodyFilter):
+        ''' Responses of the requests of a failed changeset, resubmitting halves in one batch until the failing requests are isolated '''
 
-            template = 'Content-Type: application/http\nContent-Transfer-Encoding:binary\n\n{0}\n\n'  # \n are important!!
+        if len(changeRequests) == 1:
+            return [failure]
 
-            if isinstance(req, OdataChangeset):
-                return "{0}\n".format(req)
+        middle = len(changeRequests) // 2
+        halves = [changeRequests[:middle], changeRequests[middle:]]
+        Instrumentation.Count("odata.batch.bisections")
+        responses = Odata._mergeBatchResponses(self._SendBatch([OdataChangeset(half) for half in halves], False), bodyFilter)
+
+        results = []
+        for half, response in zip(halves, responses):
+            if isinstance(response, OdataResponsePart):  # this half failed as well
+                results.extend(self._Bisect(half, response, bodyFilter))
             else:
-                return template.format(req)
+                results.extend(response)
+        return results
+
+    def IterateBatch(self, requests, bodyFilter=None):
+        '''
+            Execute requests in batch (synchronously) and yield the responses while they are read from the connection
+            Only the part being read is kept in memory, instead of the full response and all parts (see ExecuteBatch)
+            Parts are yielded as in ExecuteBatch (changesets as lists), changesets are not bisected
+            Transports without Open (see OdataTransport) read the full response first
+        '''
+
+        isStreamed = hasattr(self.transport, "Open")
+        try:
+            for _, parts in self._SplitBatch(requests):
+                body, contentType = Odata._FormatBatch(parts)
+                response = self._ExecuteResponse(self.serviceUrl + "$batch", body, "POST", contentType, None, None, isStreamed)
+                if response.Error is not None:
+                    raise response.Error
+
+                start = time.time()
+                try:
+                    reader = response.Reader if response.Body is None else response.Body
+                    for part in OdataBatchReader(reader, bodyFilter).Parts():
+                        yield part
+                finally:
+                    if response.Body is None:
+                        response.Close()
+                    Instrumentation.Observe("odata", "$batch", "POST", "stream", time.time() - start)
+        finally:
+            self._InvalidateCache(requests)
+
+    def _SendBatch(self, requests, isAsync):
+        '''
+            Send requests as one or more $batch requests, returns a raw response (or task) per wire batch
+            Wire batches are sent one after the other, in Async mode each task waits for the previous wire batch first
+            so the requests are applied in their original order. Cached responses are invalidated per answered wire batch.
+        '''
+
+        batches = self._SplitBatch(requests)
+        if not isAsync:
+            return [self._ExecuteBatchPartsAfter(None, batchRequests, parts) for batchRequests, parts in batches]
+
+        tasks = []
+        for batchRequests, parts in batches:
+            previous = tasks[-1] if tasks else None
+            tasks.append(Odata._StartTask(lambda previous=previous, batchRequests=batchRequests, parts=parts: self._ExecuteBatchPartsAfter(previous, batchRequests, parts)))
+        return tasks
+
+    def _ExecuteBatchPartsAfter(self, previous, requests, parts):
+        ''' Send parts once the previous wire batch is answered, its error is raised (as the Sync loop stops at it) '''
+
+        if previous is not None:
+            Odata.Await(previous)
+        try:
+            return self._ExecuteBatchParts(parts, False)
+        finally:
+            self._InvalidateCache(requests)
+
+    def _SplitBatch(self, requests):
+        ''' Assign missing Content-IDs and group the requests into wire batches, see OdataBatchWriter.Split '''
 
-        subRequests = [format(req) for req in requests]  # add http request headers to subrequests
+        for changeSet in requests:
+            if isinstance(changeSet, OdataChangeset):
+                for i, req in enumerate(changeSet.changeRequests):
+                    if req.contentId is None:
+                        req.contentId = str(i)
+
+        start = time.time()
+        batches = self.batchWriter.Split(requests)
+        Instrumentation.Observe("odata", "$batch", "POST", "serialize", time.time() - start)
 
-        boundary = type + "_" + str(System.Guid.NewGuid())  # seperator is a random guid
-        fullSeparator = "--" + boundary  # seperator in correct format
+        for batchRequests, _ in batches:
+            Instrumentation.Observe("odata", "$batch", "POST", "parts", sum(OdataBatchWriter._countOperations(req) for req in batchRequests))
 
-        result = fullSeparator + "\n"
-        for subRequest in subRequests:
-            result += subRequest
-            if subRequests[-1] != subRequest:  # not last
-                result += "{0}\n".format(fullSeparator)  # separate subrequests using fullSepeartor
-            else:  # last item
-                result += "{0}--".format(fullSeparator)  # separate subrequests using fullSepeartor
+        return batches
 
-        return (result, boundary)
+    def _ExecuteBatchParts(self, parts, isAsync):
+        ''' Send already formatted parts as a single $batch request '''
+
+        fullRequest, contentType = Odata._FormatBatch(parts)
+        return self._ExecuteRaw(self.serviceUrl + "$batch", fullRequest, "POST", contentType, isAsync=isAsync)
 
     @staticmethod
-    def _parseBatchResponse(batchResponse):
-        ''' parse the response (string) into a python object '''
+    def _FormatBatch(parts):
+        ''' Returns (body, content type) of a $batch request with already formatted parts '''
+
+        start = time.time()
+        boundary = OdataBatchWriter.NewBoundary("batch")
+        buffer = []
+        OdataBatchWriter.Write(boundary, parts, buffer.append)
+        fullRequest = "".join(buffer)
+        Instrumentation.Observe("odata", "$batch", "POST", "serialize", time.time() - start)
+
+        return (fullRequest, "multipart/mixed; boundary=" + boundary)
+
+    def ExecuteMany(self, requests, maxConcurrency=4, ordered=True):
+        '''
+            Execute requests with at most maxConcurrency requests in flight, independent of the configured OdataMethod
+            Each item is either an OdataRequest (see Execute) or a list of requests/changesets (see ExecuteBatch)
+            Responses are parsed as soon as they complete, errors are captured per request instead of raised
+
+            Every result has the attributes Index (position in requests), Request, Result (parsed response) and Error
+            ordered=True returns a list in input order, ordered=False returns an iterator in completion order
+        '''
+
+        results = self._IterateMany(requests, max(1, maxConcurrency))
+        if not ordered:
+            return results
+
+        orderedResults = [None] * len(requests)
+        for result in results:
+            orderedResults[result.Index] = result
+        return orderedResults
+
+    def _IterateMany(self, requests, maxConcurrency):
+        import System
+        from System.Threading.Tasks import Task
+
+        running = []  # list of (task, index), tasks are started in input order
+        nextIndex = 0
+
+        while nextIndex < len(requests) or running:
+
+            # fill up to the concurrency limit
+            while nextIndex < len(requests) and len(running) < maxConcurrency:
+                running.append((self._StartItem(nextIndex, requests[nextIndex]), nextIndex))
+                nextIndex += 1
+
+            completed = Task.WaitAny(System.Array[Task]([task for task, _ in running]))
+            task, _ = running.pop(completed)
+            yield task.Result
+
+    def _StartItem(self, index, request):
+        ''' Start task that executes & parses one item of ExecuteMany, exceptions are stored on the result '''
+
+        from Objects import Objects
+
+        def execute():
+            result = Objects.Dynamic()
+            result.Index = index
+            result.Request = request
+            result.Result = None
+            result.Error = None
+            try:
+                if isinstance(request, OdataRequest):
+                    result.Result = self._ExecuteParsed(request)
+                else:
+                    result.Result = Odata._mergeBatchResponses(self._SendBatch(request, False))
+            except Exception as e:
+                result.Error = e
+            return result
+
+        return Odata._StartTask(execute)
 
-        batchResponse = batchResponse.replace("\r\n", "\n").replace("\r", "\n")  # remove incompatible newlines
-        batchBoundary = batchResponse[0:batchResponse.index("\n")]  # first line contains boundary
+    @staticmethod
+    def _mergeBatchResponses(batchResponses, bodyFilter=None):
+        ''' parse multiple batch responses (strings) into a single list of python objects '''
 
-        # split on boundary - remove empty elements - remove element if '--\n' (=last element)
-        batchResponses = filter(lambda x: x != "" and x != "--\n", batchResponse.split(batchBoundary))
+        return [response for batchResponse in batchResponses for response in Odata._parseBatchResponse(batchResponse, bodyFilter)]
 
-        return [Odata._processResponse(rawResponse) for rawResponse in batchResponses]
+    def _GetCsrf(self):
+        ''' Get csrf token & cookies from the process wide cache, fetching them from c4c when missing or expired '''
 
-    @staticmethod
-    def _getResponseObject(rawResponse):
-        rawSplit = rawResponse.split("\n\n")[1:]  # split by 2 newlines - ignore first part (=batch information)
+        return OdataCsrfCache.Get(self.sapId, self.username, self._fetchCsrf)
 
-        rawResponseHeaders = rawSplit[0].split("\n")
-        response = Objects.Dynamic()
-        response.StatusLine = rawResponseHeaders.pop(0)  # retrieve & remove first line, leaving only headers
+    def _fetchCsrf(self):
+        ''' Get csrf token from c4c using a HEAD request on the service root (no need to download $metadata) '''
 
-        def _getHeader(rawHeader):
-            rawHeaderSplit = rawHeader.split(": ")
-            header = Objects.Dynamic()
-            header.Name = rawHeaderSplit[0]
-            header.Value = rawHeaderSplit[1]
-            return header
+        Log.Write("reloading csrf token")
+        Instrumentation.Count("odata.csrf.refresh")
 
-        response.Headers = [_getHeader(rawHeader) for rawHeader in rawResponseHeaders]
-        response.Body = Odata._parseJson(rawSplit[1])
+        headers = dict(self.defaultHeaders)
+        headers["x-csrf-token"] = "fetch"
+        response = self.transport.Send("HEAD", self.serviceUrl, headers)
+        if response.Error is not None:
+            raise response.Error
 
-        return response
+        from Objects import Objects
+
+        csrf = Objects.Dynamic()
+        csrf.token = response.Headers.get("x-csrf-token")
+        csrf.cookies = [cookie for cookie in response.Headers.get("set-cookie", "").split(",") if cookie != ""]
+        csrf.headers = {"x-csrf-token": csrf.token, "Cookie": ";".join(csrf.cookies)}  # precomputed for every request
+
+        return csrf
 
     @staticmethod
-    def _parseJson(rawJsonString):
-        json = RestClient.DeserializeJson(rawJsonString)
-        if hasattr(json, "d"):
-            json = json.d
-        if hasattr(json, "results"):
-            json = json.results
-        return json
+    def _combineRequests(type, requests):
+        ''' generate boundary and use it to create a odata compatible string representation for batching '''
+
+        return OdataBatchWriter.Combine(type, requests)
 
     @staticmethod
-    def _getChangesetObject(rawResponse):
-        firstLine = rawResponse[0:rawResponse.index("\n")]  # first line contains boundary
-        changesetBoundary = "--" + firstLine.split("; ")[1].split("=")[1]  # ex: Content-Type: multipart/mixed; boundary=ejjeeffe1
+    def _parseBatchResponse(batchResponse, bodyFilter=None):
+        ''' parse the response (string) into a python object '''
 
-        # split on boundary - remove first & last element
-        changesetResponses = rawResponse.split(changesetBoundary)[1:-1]
+        return list(Odata.IterateBatchResponse(batchResponse, bodyFilter))
 
-        return [Odata._processResponse(rawChangesetResponse) for rawChangesetResponse in changesetResponses]
+    @staticmethod
+    def IterateBatchResponse(batchResponse, bodyFilter=None):
+        ''' parse the response (string, .NET TextReader or python file object) lazily, part by part '''
+
+        return OdataBatchReader(batchResponse, bodyFilter).Parts()
 
     @staticmethod
-    def _processResponse(rawResponse):
-        rawResponse = rawResponse.lstrip()
-        if rawResponse.startswith("Content-Type: application/http"):
-            return Odata._getResponseObject(rawResponse)
-        if rawResponse.startswith("Content-Type: multipart/mixed; boundary="):
-            return Odata._getChangesetObject(rawResponse)
-        if rawResponse.startswith("Content-Type: multipart/mixed"):
-            return None
+    def _parseJson(rawJsonString):
+        return OdataJson.Parse(rawJsonString)
+
+    @staticmethod
+    def _parseJsonPage(rawJsonString):
+        ''' parse a collection into (entities, next link), the next link is dropped by _parseJson '''
+
+        return OdataJson.ParsePage(rawJsonString)
 
     @staticmethod
     def Await(task, transformations=[]):
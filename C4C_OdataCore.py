@@ -0,0 +1,474 @@
+'''
+    Dependency free core of C4C_Odata: request & changeset serialization, multipart batch writing & parsing, json unwrapping
+    Does not load the CLR or CPQ modules, so it imports fast and runs under CPython as well (C4C_Odata re-exports it)
+    json & uuid are imported on first use, they account for most of the import time otherwise
+'''
+
+import copy
+
+_urlSafe = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.!*()"
+_urlEncoded = ["+" if i == 32 else chr(i) if chr(i) in _urlSafe else "%{0:02x}".format(i) for i in range(256)]  # per utf-8 byte
+
+def UrlEncode(value):
+    ''' Same result as HttpUtility.UrlEncode: utf-8, spaces as "+", lowercase hex '''
+
+    if not isinstance(value, ("".__class__, u"".__class__)):
+        value = str(value)
+    try:
+        data = bytearray(value.encode("utf-8"))
+    except UnicodeDecodeError:  # already encoded
+        data = bytearray(value)
+    return "".join([_urlEncoded[byte] for byte in data])
+
+class OdataRequest:
+    '''
+        individual request model, the url and header block are built once and cached
+        use withQuery / withBody for variants, they reuse the cached parts that did not change
+        the query may still be changed in place (ex: request.query["skip"] = "100"), the url is rebuilt when it differs from the cached one
+    '''
+
+    class Method:
+        ''' Available methods for odata requests'''
+        GET = "GET"
+        POST = "POST"
+        PATCH = "PATCH"
+        PUT = "PUT"
+        DELETE = "DELETE"
+
+    _urlAttributes = ("method", "url", "query")
+    _headerAttributes = ("method", "contentId", "body", "contentType", "accept")
+
+    def __init__(self, method, url, query=None, contentId=None, body=None, contentType="application/json", accept="application/json"):
+        ''' create new request, the query is copied '''
+        self.__dict__["_url"] = None
+        self.__dict__["_urlQuery"] = None  # copy of the query the cached url was built from
+        self.__dict__["_headers"] = None
+        self.method = method
+        self.url = url
+        self.query = dict(query) if query is not None else {}
+        self.contentId = contentId
+        self.body = body
+        self.contentType = contentType
+        self.accept = accept
+
+    def __setattr__(self, name, value):
+        ''' assigning an attribute (ex: contentId when batching) drops the cached parts depending on it '''
+
+        self.__dict__[name] = value
+        if name in OdataRequest._urlAttributes:
+            self.__dict__["_url"] = None
+        if name in OdataRequest._headerAttributes:
+            self.__dict__["_headers"] = None
+
+    def withQuery(self, query=None, **values):
+        ''' copy with query values added or replaced, ex: request.withQuery(top="10", skip="20") '''
+
+        merged = dict(self.query)
+        merged.update(query or {})
+        merged.update(values)
+
+        variant = copy.copy(self)
+        variant.query = merged
+        return variant
+
+    def withBody(self, body):
+        ''' copy with another body, ex: the same PATCH for every item '''
+
+        variant = copy.copy(self)
+        variant.query = dict(self.query)  # not shared with the original, like withQuery
+        variant.body = body
+        return variant
+
+    def getUrl(self):
+        ''' relative url including the query, ex: QuoteCollection?$top=1&$format=json '''
+
+        if self._url is None or self.query != self._urlQuery:
+            self.__dict__["_url"] = self._buildUrl()
+            self.__dict__["_urlQuery"] = dict(self.query)
+        return self._url
+
+    def _buildUrl(self):
+
+        # default to json format for get queries (without changing the query of the request)
+        query = self.query
+        if self.method == OdataRequest.Method.GET and "format" not in query:
+            query = dict(query)
+            query["format"] = "json"
+
+        if not query:
+            return self.url
+        return self.url + "?" + "&".join("${0}={1}".format(key, UrlEncode(value)) for key, value in query.items())
+
+    def _getHeaders(self):
+        ''' header lines following the request line, each starting with a newline '''
+
+        if self._headers is None:
+            headers = []
+            if self.method != OdataRequest.Method.GET:
+                headers.append("Content-Type: " + self.contentType)
+            if self.contentId is not None:
+                headers.append("Content-ID: " + self.contentId)
+            if self.body is not None:
+                headers.append("Content-Length: " + str(OdataRequest._byteLength(self.body)))
+            if self.method != OdataRequest.Method.GET:
+                headers.append("Accept: " + self.accept)
+            self.__dict__["_headers"] = "".join("\n" + header for header in headers)
+        return self._headers
+
+    @staticmethod
+    def _byteLength(body):
+        ''' Content-Length counts bytes, not characters '''
+
+        try:
+            return len(body.encode("utf-8"))
+        except UnicodeDecodeError:  # already encoded
+            return len(body)
+
+    def __str__(self):
+        ''' create string respresentation of individual request '''
+
+        request = self.method + " " + self.getUrl() + " HTTP/1.1" + self._getHeaders()
+
+        # body
+        if self.body is not None:
+            return request + "\n\n" + self.body
+        return request + "\n"
+
+class OdataChangeset:
+    ''' array of requests that make changes (POST, PATCH, ...) '''
+
+    def __init__(self, changeRequests):
+        ''' Create new changeset '''
+        self.changeRequests = changeRequests
+
+    def __str__(self):
+        ''' create string representation of changeset request '''
+
+        fullRequest, boundary = OdataBatchWriter.Combine("changeset", self.changeRequests)
+        rawChangeset = "Content-Type: multipart/mixed; boundary={0}\n\n".format(boundary)
+        rawChangeset += fullRequest
+
+        return rawChangeset
+
+class OdataBatchWriter:
+    ''' single pass serializer for multipart batch bodies, optionally limiting the amount of parts & bytes per batch '''
+
+    partTemplate = 'Content-Type: application/http\nContent-Transfer-Encoding:binary\n\n{0}\n\n'  # \n are important!!
+
+    def __init__(self, maxParts=None, maxBytes=None):
+        ''' Create new writer, without limits all requests end up in a single batch '''
+        self.maxParts = maxParts
+        self.maxBytes = maxBytes
+
+    @staticmethod
+    def NewBoundary(type):
+        import uuid
+
+        return type + "_" + str(uuid.uuid4())
+
+    @staticmethod
+    def Combine(type, requests):
+        ''' generate boundary and use it to create a odata compatible string representation for batching, returns (body, boundary) '''
+
+        boundary = OdataBatchWriter.NewBoundary(type)  # seperator is a random guid
+        buffer = []
+        OdataBatchWriter.Write(boundary, [OdataBatchWriter.FormatPart(req) for req in requests], buffer.append)
+
+        return ("".join(buffer), boundary)
+
+    @staticmethod
+    def FormatPart(req):
+        ''' add http request headers to subrequest (changesets carry their own headers) '''
+
+        if isinstance(req, OdataChangeset):
+            return "{0}\n".format(req)
+        else:
+            return OdataBatchWriter.partTemplate.format(req)
+
+    @staticmethod
+    def Write(boundary, parts, write):
+        '''
+            Write formatted parts separated by the boundary in one pass
+            write is any callable accepting a string, ex: list.append, StringIO.write or StringWriter.Write
+        '''
+
+        fullSeparator = "--" + boundary  # seperator in correct format
+        write(fullSeparator + "\n")
+
+        last = len(parts) - 1
+        for i, part in enumerate(parts):
+            write(part)
+            if i != last:
+                write(fullSeparator + "\n")  # separate subrequests using fullSeparator
+            else:
+                write(fullSeparator + "--")  # closing separator
+
+    @staticmethod
+    def _countOperations(req):
+        return len(req.changeRequests) if isinstance(req, OdataChangeset) else 1
+
+    def Split(self, requests):
+        '''
+            Group requests into wire batches respecting maxParts (operations) & maxBytes
+            A changeset is never split, if it exceeds the limits on its own it is sent as a separate batch
+            Returns a list of (requests, formattedParts) tuples, in original order
+        '''
+
+        batches = []
+        currentRequests, currentParts = [], []
+        currentOperations, currentBytes = 0, 0
+        separatorBytes = len("--batch_") + 36 + 2  # one separator (boundary with guid) per part, incl. newline or closing dashes
+
+        for req in requests:
+            part = OdataBatchWriter.FormatPart(req)
+            operations = OdataBatchWriter._countOperations(req)
+            size = len(part.encode("utf-8")) + separatorBytes if self.maxBytes is not None else 0
+
+            exceedsParts = self.maxParts is not None and currentOperations + operations > self.maxParts
+            exceedsBytes = self.maxBytes is not None and currentBytes + size > self.maxBytes
+            if currentRequests and (exceedsParts or exceedsBytes):
+                batches.append((currentRequests, currentParts))
+                currentRequests, currentParts = [], []
+                currentOperations, currentBytes = 0, 0
+
+            currentRequests.append(req)
+            currentParts.append(part)
+            currentOperations += operations
+            currentBytes += size
+
+        if currentRequests or not batches:
+            batches.append((currentRequests, currentParts))
+
+        return batches
+
+class OdataResponsePart(object):
+    ''' Response of a single operation in a batch, the json body is only deserialized on first access of Body '''
+
+    _unparsed = object()
+
+    def __init__(self, statusLine, headers):
+        self.StatusLine = statusLine
+        self.Headers = headers
+        self.RawBody = None  # stays None when the body is skipped
+        self._body = OdataResponsePart._unparsed
+
+    @property
+    def StatusCode(self):
+        ''' ex: 204 for "HTTP/1.1 204 No Content" '''
+
+        return int(self.StatusLine.split(" ")[1]) if self.StatusLine else None
+
+    @property
+    def Body(self):
+        if self._body is OdataResponsePart._unparsed:
+            self._body = OdataJson.Parse(self.RawBody)
+        return self._body
+
+    @staticmethod
+    def ExcludeStatus(*statusCodes):
+        ''' Body filter skipping the body of parts with the given status codes, ex: ExcludeStatus(201, 204) '''
+
+        return lambda part: part.StatusCode not in statusCodes
+
+class OdataBatchReader:
+    ''' Single pass parser for multipart batch responses, parts are yielded lazily (supports nested changesets) '''
+
+    def __init__(self, source, bodyFilter=None):
+        '''
+            source is a string, a .NET TextReader or a python file object
+            bodyFilter is an optional function (part -> bool) deciding which bodies are kept, others are skipped entirely
+        '''
+
+        self._lines = OdataBatchReader.Lines(source)
+        self._bodyFilter = bodyFilter
+        self._pending = None  # line that was read ahead and pushed back
+        self._separators = set()  # boundary lines of all (nested) multiparts being read
+
+    @staticmethod
+    def Lines(source):
+        ''' Iterate lines without newline characters (\r\n or \n), without copying the full source '''
+
+        if hasattr(source, "ReadLine"):  # .NET TextReader
+            line = source.ReadLine()
+            while line is not None:
+                yield line
+                line = source.ReadLine()
+        elif hasattr(source, "readline"):  # python file object
+            for line in iter(source.readline, ""):
+                yield line.rstrip("\r\n")
+        else:
+            start, length = 0, len(source)
+            while start < length:
+                end = source.find("\n", start)
+                if end == -1:
+                    end = length
+                yield source[start:end - 1] if end > start and source[end - 1] == "\r" else source[start:end]
+                start = end + 1
+
+    def Parts(self):
+        ''' Yield response objects, lists of response objects (changesets) or None (unknown parts) '''
+
+        line = self._readLine()
+        while line is not None and not line.startswith("--"):  # first line contains boundary
+            line = self._readLine()
+        if line is None:
+            return
+
+        self._pending = line
+        for part in self._readParts(line[2:]):
+            yield part
+
+    def _readLine(self):
+        if self._pending is not None:
+            line, self._pending = self._pending, None
+            return line
+        return next(self._lines, None)
+
+    def _readUntilSeparator(self, collect=None):
+        ''' Read until a boundary line, which is returned (None at the end), other lines are added to collect '''
+
+        line = self._readLine()
+        while line is not None and line not in self._separators:
+            if collect is not None:
+                collect.append(line)
+            line = self._readLine()
+        return line
+
+    def _readHeaders(self):
+        ''' Read "Name: Value" lines until an empty line, values may contain ": " '''
+
+        headers = []
+        line = self._readLine()
+        while line is not None and line != "":
+            if line in self._separators:
+                self._pending = line
+                break
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+            line = self._readLine()
+        return headers
+
+    def _readParts(self, boundary):
+        ''' Yield parts of a multipart until its closing boundary '''
+
+        separator, closing = "--" + boundary, "--" + boundary + "--"
+        self._separators.update((separator, closing))
+        try:
+            line = self._readUntilSeparator()
+            while line == separator:
+                yield self._readPart()
+                line = self._readUntilSeparator()
+            if line is not None and line != closing:
+                self._pending = line  # boundary of an enclosing multipart
+        finally:
+            self._separators.difference_update((separator, closing))
+
+    def _readPart(self):
+
+        mimeHeaders = dict((name.lower(), value) for name, value in self._readHeaders())
+        contentType = mimeHeaders.get("content-type", "")
+
+        if contentType.startswith("application/http"):
+            return self._readResponse()
+
+        if contentType.startswith("multipart/mixed") and "boundary=" in contentType:
+            boundary = contentType.split("boundary=")[1].split(";")[0].strip().strip('"')  # ex: multipart/mixed; boundary=ejjeeffe1
+            return list(self._readParts(boundary))
+
+        return None
+
+    def _readResponse(self):
+
+        statusLine = self._readLine()
+        while statusLine == "":
+            statusLine = self._readLine()
+        if statusLine is not None and statusLine in self._separators:
+            self._pending, statusLine = statusLine, None
+
+        headers = [OdataBatchReader._getHeader(name, value) for name, value in self._readHeaders()]
+        response = OdataResponsePart(statusLine, headers)
+
+        if self._bodyFilter is None or self._bodyFilter(response):
+            bodyLines = []
+            self._pending = self._readUntilSeparator(bodyLines)
+            response.RawBody = "\n".join(bodyLines).strip()  # deserialized on first access
+        else:
+            self._pending = self._readUntilSeparator()
+
+        return response
+
+    @staticmethod
+    def _getHeader(name, value):
+        return OdataHeader(name, value)
+
+class OdataHeader(object):
+    ''' Header of a batch response part '''
+
+    def __init__(self, name, value):
+        self.Name = name
+        self.Value = value
+
+class _JsonObject(dict):
+    ''' Json object with attribute access, like the objects returned by RestClient.DeserializeJson '''
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+class OdataJson:
+    ''' Deserialize & unwrap c4c json responses ({"d": {"results": [...], "__next": ...}}) '''
+
+    _deserialize = None  # function: string -> object with attribute access, see SetDeserializer
+
+    @staticmethod
+    def SetDeserializer(deserialize):
+        ''' Defaults to RestClient.DeserializeJson in CPQ, to the json module elsewhere '''
+
+        OdataJson._deserialize = staticmethod(deserialize)
+
+    @staticmethod
+    def Deserialize(rawJsonString):
+
+        if OdataJson._deserialize is None:
+            try:
+                OdataJson.SetDeserializer(RestClient.DeserializeJson)  # CPQ builtin
+            except NameError:
+                import json
+
+                OdataJson.SetDeserializer(lambda raw: json.loads(raw, object_hook=_JsonObject))
+        return OdataJson._deserialize(rawJsonString)
+
+    @staticmethod
+    def IsEmpty(rawJsonString):
+        return rawJsonString is None or rawJsonString == "" or rawJsonString.isspace()
+
+    @staticmethod
+    def Parse(rawJsonString):
+        ''' parse json and unwrap "d" and "results", None for an empty body (ex: 204 No Content) '''
+
+        if OdataJson.IsEmpty(rawJsonString):
+            return None
+
+        json = OdataJson.Deserialize(rawJsonString)
+        if hasattr(json, "d"):
+            json = json.d
+        if hasattr(json, "results"):
+            json = json.results
+        return json
+
+    @staticmethod
+    def ParsePage(rawJsonString):
+        ''' parse a collection into (entities, next link), no entities for an empty body '''
+
+        if OdataJson.IsEmpty(rawJsonString):
+            return ([], None)
+
+        json = OdataJson.Deserialize(rawJsonString)
+        if hasattr(json, "d"):
+            json = json.d
+        nextLink = getattr(json, "__next", None)
+        if hasattr(json, "results"):
+            json = json.results
+        return (json, nextLink)
@@ -0,0 +1,284 @@
+import threading
+import time
+
+from System.IO import MemoryStream, StreamReader
+from System.IO.Compression import CompressionMode, DeflateStream, GZipStream
+from System.Net import WebException, WebRequest
+from System.Text import Encoding
+
+from Objects import Objects
+
+
+class OdataTransport:
+    '''
+        Keep-alive http transport used by Odata, connections are pooled per host and reused across requests.
+        Any object with the same Send method can be used instead (ex: a stand-in for a local test server),
+        Open is optional (streamed responses, see Odata.IterateBatch).
+
+        Compression is driven by the request headers: gzip / deflate responses are decompressed transparently
+        (send Accept-Encoding to get them) and the body is compressed when the Content-Encoding header is gzip or deflate.
+    '''
+
+    maxConnectionsPerHost = 10
+    timeout = 100000  # milliseconds
+
+    _shared = None
+    _sharedLock = threading.Lock()
+
+    def __init__(self, maxConnectionsPerHost=None, timeout=None):
+        ''' Create new transport, prefer OdataTransport.Shared() to reuse connections across Odata instances '''
+
+        if maxConnectionsPerHost is not None:
+            self.maxConnectionsPerHost = maxConnectionsPerHost
+        if timeout is not None:
+            self.timeout = timeout
+
+        self._hosts = set()  # hosts for which the connection pool (ServicePoint) is configured
+        self._lock = threading.Lock()
+        self.ResetStats()
+
+    @staticmethod
+    def Shared():
+        ''' Process wide transport instance '''
+
+        with OdataTransport._sharedLock:
+            if OdataTransport._shared is None:
+                OdataTransport._shared = OdataTransport()
+            return OdataTransport._shared
+
+    def Configure(self, maxConnectionsPerHost):
+        ''' Change the connection limit, applied to every host on its next request '''
+
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self._hosts = set()
+
+    def ResetStats(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "errors": 0,
+                "seconds": 0.0,
+                "overheadSeconds": 0.0,  # time spent before waiting on the response (connect, headers, upload)
+                "bytesSent": 0,  # bytes on the wire (compressed)
+                "bytesReceived": 0,
+                "bytesSentUncompressed": 0,
+                "bytesReceivedUncompressed": 0,  # without compressed streamed responses (Open), their size is not known
+                "connections": {},  # host -> peak amount of open connections
+            }
+
+    def GetStats(self):
+        ''' Copy of the statistics, including average seconds per request '''
+
+        with self._lock:
+            stats = dict(self.stats)
+            stats["connections"] = dict(self.stats["connections"])
+
+        requests = stats["requests"] or 1
+        stats["averageSeconds"] = stats["seconds"] / requests
+        stats["averageOverheadSeconds"] = stats["overheadSeconds"] / requests
+        return stats
+
+    def _configureHost(self, servicePoint):
+        ''' Configure connection pool once per host: keep-alive connections, limited per host, no 100-continue round trip '''
+
+        host = servicePoint.Address.Host
+        if host in self._hosts:
+            return
+
+        servicePoint.ConnectionLimit = self.maxConnectionsPerHost
+        servicePoint.Expect100Continue = False
+        servicePoint.UseNagleAlgorithm = False
+        self._hosts.add(host)
+
+    def Send(self, method, url, headers, body=None):
+        '''
+            Send http request and return a response object (StatusCode, Headers, Body, Error, BytesSent, BytesReceived)
+            Http errors do not raise, the WebException is returned as Error. Headers are keyed in lowercase.
+            BytesSent & BytesReceived are the (compressed) bytes on the wire, Body is always decompressed.
+        '''
+
+        return self._send(method, url, headers, body, False)
+
+    def Open(self, method, url, headers, body=None):
+        '''
+            Same as Send, but the body of a successful response is not read: Body is None and Reader is a TextReader
+            over the (decompressed) response stream. The response has to be closed with response.Close() once read.
+            Error responses are read completely, as in Send.
+        '''
+
+        return self._send(method, url, headers, body, True)
+
+    def _send(self, method, url, headers, body, isStreamed):
+
+        start = time.time()
+
+        request = WebRequest.Create(url)
+        request.Method = method
+        request.KeepAlive = True
+        request.Timeout = self.timeout
+        self._configureHost(request.ServicePoint)
+
+        contentEncoding = None
+        for name, value in headers.items():
+            lowerName = name.lower()
+            if lowerName == "content-type":  # restricted headers have to be set through their property
+                request.ContentType = value
+            elif lowerName == "accept":
+                request.Accept = value
+            else:
+                request.Headers[name] = value
+                if lowerName == "content-encoding":
+                    contentEncoding = value.lower()
+
+        bytesSent, uncompressedSent = 0, 0
+        if body is not None:
+            data = Encoding.UTF8.GetBytes(body)
+            uncompressedSent = data.Length
+            if contentEncoding in ("gzip", "deflate"):
+                data = OdataTransport._Compress(data, contentEncoding)
+            bytesSent = data.Length
+            request.ContentLength = bytesSent
+            stream = request.GetRequestStream()
+            try:
+                stream.Write(data, 0, data.Length)
+            finally:
+                stream.Close()
+
+        overhead = time.time() - start
+
+        error = None
+        try:
+            webResponse = request.GetResponse()
+        except WebException as e:
+            if e.Response is None:  # no http response (dns, timeout, connection refused, ...)
+                self._record(request, time.time() - start, overhead, bytesSent, uncompressedSent, 0, 0, True)
+                raise
+            webResponse = e.Response
+            error = e
+
+        if isStreamed and error is None:
+            return self._openResponse(request, webResponse, start, overhead, bytesSent, uncompressedSent)
+
+        try:
+            response = OdataTransport._readResponse(webResponse)
+        finally:
+            webResponse.Close()
+
+        response.Error = error
+        response.BytesSent = bytesSent
+        uncompressedReceived = Encoding.UTF8.GetByteCount(response.Body)
+        if response.BytesReceived is None:  # not compressed
+            response.BytesReceived = uncompressedReceived
+        self._record(request, time.time() - start, overhead, bytesSent, uncompressedSent, response.BytesReceived, uncompressedReceived, error is not None)
+
+        return response
+
+    def _openResponse(self, request, webResponse, start, overhead, bytesSent, uncompressedSent):
+        ''' Streamed response (see Open), statistics are recorded when it is closed '''
+
+        try:
+            response = OdataTransport._getResponse(webResponse)
+            response.Reader = StreamReader(OdataTransport._getBodyStream(webResponse, response), Encoding.UTF8)
+        except Exception:
+            webResponse.Close()
+            raise
+
+        response.Body = None
+        response.Error = None
+        response.BytesSent = bytesSent
+        uncompressedReceived = 0  # compressed: the decompressed size is not known without counting the stream, not recorded
+        if response.BytesReceived is None:  # not compressed, the bytes on the wire are the body
+            response.BytesReceived = max(0, int(webResponse.ContentLength))
+            uncompressedReceived = response.BytesReceived
+
+        def close():
+            try:
+                response.Reader.Close()
+            finally:
+                webResponse.Close()
+            self._record(request, time.time() - start, overhead, bytesSent, uncompressedSent, response.BytesReceived, uncompressedReceived, False)
+
+        response.Close = close
+        return response
+
+    @staticmethod
+    def _readResponse(webResponse):
+        ''' Response with decompressed body, BytesReceived is only set for compressed responses '''
+
+        response = OdataTransport._getResponse(webResponse)
+        reader = StreamReader(OdataTransport._getBodyStream(webResponse, response), Encoding.UTF8)
+        try:
+            response.Body = reader.ReadToEnd()
+        finally:
+            reader.Close()
+
+        return response
+
+    @staticmethod
+    def _getResponse(webResponse):
+
+        response = Objects.Dynamic()
+        response.StatusCode = int(webResponse.StatusCode)
+        response.Headers = dict((key.lower(), webResponse.Headers[key]) for key in webResponse.Headers.AllKeys)
+        response.BytesReceived = None
+        return response
+
+    @staticmethod
+    def _getBodyStream(webResponse, response):
+        ''' Decompressed response stream, compressed bodies are buffered to count the bytes on the wire (sets BytesReceived) '''
+
+        stream = webResponse.GetResponseStream()
+        contentEncoding = response.Headers.get("content-encoding", "").lower()
+        if contentEncoding in ("gzip", "deflate"):
+            compressed = MemoryStream()
+            try:
+                stream.CopyTo(compressed)
+            finally:
+                stream.Close()
+            response.BytesReceived = int(compressed.Length)
+            compressed.Position = 0
+            stream = OdataTransport._Decompress(compressed, contentEncoding)
+
+        return stream
+
+    @staticmethod
+    def _Compress(data, contentEncoding):
+
+        output = MemoryStream()
+        if contentEncoding == "gzip":
+            stream = GZipStream(output, CompressionMode.Compress)
+        else:
+            stream = DeflateStream(output, CompressionMode.Compress)
+        try:
+            stream.Write(data, 0, data.Length)
+        finally:
+            stream.Close()  # writes the remaining compressed data
+        return output.ToArray()
+
+    @staticmethod
+    def _Decompress(compressed, contentEncoding):
+
+        if contentEncoding == "gzip":
+            return GZipStream(compressed, CompressionMode.Decompress)
+
+        # "deflate" is zlib data (RFC 1950) for most servers, DeflateStream only reads the raw data without the 2 byte header
+        if compressed.Length > 2 and compressed.ReadByte() == 0x78:
+            compressed.Position = 2
+        else:
+            compressed.Position = 0
+        return DeflateStream(compressed, CompressionMode.Decompress)
+
+    def _record(self, request, duration, overhead, bytesSent, uncompressedSent, bytesReceived, uncompressedReceived, isError):
+
+        host = request.ServicePoint.Address.Host
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["errors"] += 1 if isError else 0
+            self.stats["seconds"] += duration
+            self.stats["overheadSeconds"] += overhead
+            self.stats["bytesSent"] += bytesSent
+            self.stats["bytesReceived"] += bytesReceived
+            self.stats["bytesSentUncompressed"] += uncompressedSent
+            self.stats["bytesReceivedUncompressed"] += uncompressedReceived
+            connections = self.stats["connections"]
+            connections[host] = max(connections.get(host, 0), request.ServicePoint.CurrentConnections)
@@ -1,17 +1,476 @@
 import clr
 
-clr.AddReference("System.Xml")
+import time
 
 import System
-from System.Xml import XmlDocument, XmlNamespaceManager
 
-from Helper import Helper, CPQ
-from Mappings import Mappings
-from CustomException import CustomException
+from C4C_Instrumentation import Instrumentation
+
+# System.Core (expressions), System.Xml, reflection and the CPQ modules (Helper, Mappings, CustomException) are loaded on first use
+
+
+class WebServiceTypeIndex:
+    ''' Name -> Type index of a generated web service assembly with compiled constructors, built once per assembly '''
+
+    def __init__(self, assembly):
+        ''' Index all types of the assembly, on name collisions the first type wins '''
+
+        start = time.time()
+
+        self.types = {}
+        for instanceType in assembly.GetTypes():
+            if instanceType.Name not in self.types:
+                self.types[instanceType.Name] = instanceType
+
+        self.constructors = {}  # Type -> function creating a new instance, compiled on first use
+        self.BuildSeconds = time.time() - start
+        self.Size = len(self.types)
+
+    def GetInstanceType(self, typeName):
+
+        instanceType = self.types.get(typeName)
+        if instanceType is None:
+            from CustomException import CustomException
+            raise CustomException("Type '{0}' does not exist in this assembly".format(typeName))
+        return instanceType
+
+    def CreateInstance(self, instanceType):
+        return self.GetConstructor(instanceType)()
+
+    def GetConstructor(self, instanceType):
+
+        constructor = self.constructors.get(instanceType)
+        if constructor is None:
+            constructor = WebServiceTypeIndex._CompileConstructor(instanceType)
+            self.constructors[instanceType] = constructor
+        return constructor
+
+    @staticmethod
+    def _CompileConstructor(instanceType):
+        ''' Compile "() => (object)new T()" into a delegate, fall back on Activator when there is no default constructor '''
+
+        clr.AddReference("System.Core")
+        from System import Activator, Func
+        from System.Linq.Expressions import Expression
+
+        try:
+            body = Expression.Convert(Expression.New(instanceType), clr.GetClrType(System.Object))
+            return Expression.Lambda[Func[object]](body).Compile()
+        except Exception:
+            return lambda: Activator.CreateInstance(instanceType)
+
+
+class WebServiceMemberAccessor:
+    ''' Precomputed setter for a field or property, including its optional "<member>Specified" companion '''
+
+    def __init__(self, memberInfo, specified=None):
+        from System.Reflection import FieldInfo
+
+        self.memberInfo = memberInfo
+        self.memberType = memberInfo.FieldType if isinstance(memberInfo, FieldInfo) else memberInfo.PropertyType
+        self.specified = specified  # WebServiceMemberAccessor of the 'Specified' member, if it exists
+        self._setter = WebServiceMemberAccessor._CompileSetter(memberInfo)
+
+    def Set(self, instance, value):
+        ''' Set value and mark it as specified '''
+
+        self.SetValue(instance, value)
+        if self.specified is not None:
+            self.specified.SetValue(instance, True)
+
+    def SetValue(self, instance, value):
+
+        isConversion = False
+        if self._setter is not None:
+            try:
+                self._setter(instance, value)
+                return
+            except Exception:
+                isConversion = True  # not supported by the compiled cast (ex: int to decimal), reflection handles it
+
+        try:
+            self.memberInfo.SetValue(instance, value)
+            if isConversion:
+                self._setter = None  # the values of a member share their type, skip the failing cast from now on
+        except ValueError as e:
+            typeName = type(instance).__name__
+            from CustomException import CustomException
+            raise CustomException("Could not set field '{0}' for instance of type '{1}' - innerexception: {2} ".format(self.memberInfo.Name, typeName, e.message))
+
+    @staticmethod
+    def _CompileSetter(memberInfo):
+        ''' Compile "(instance, value) => ((T)instance).member = (TMember)value" into a delegate, None if not possible '''
+
+        clr.AddReference("System.Core")
+        from System import Action
+        from System.Linq.Expressions import Expression
+        from System.Reflection import FieldInfo
+
+        try:
+            objectType = clr.GetClrType(System.Object)
+            instanceParameter = Expression.Parameter(objectType, "instance")
+            valueParameter = Expression.Parameter(objectType, "value")
+            target = Expression.Convert(instanceParameter, memberInfo.DeclaringType)
+
+            if isinstance(memberInfo, FieldInfo):
+                member, memberType = Expression.Field(target, memberInfo), memberInfo.FieldType
+            else:
+                member, memberType = Expression.Property(target, memberInfo), memberInfo.PropertyType
+
+            assign = Expression.Assign(member, Expression.Convert(valueParameter, memberType))
+            return Expression.Lambda[Action[object, object]](assign, instanceParameter, valueParameter).Compile()
+        except Exception:
+            return None
+
+
+class WebServiceMessagePlan:
+    '''
+        Compiled ProcessMessage dictionary: keys are parsed and types, constructors & setters are resolved once
+        Build accepts dictionaries with the same shape as the template (only the leaf values differ),
+        keys that are not in the template are compiled on first use, so Build sets the same values as ProcessMessage
+    '''
+
+    OBJECT, OBJECT_LIST, LIST, VALUE = range(4)
+
+    def __init__(self, service, template, parentType=None):
+        ''' Compile the template, parentType is only used for recursion '''
+
+        self.resultType = None  # type of the object returned by Build (last dictionary value on this level)
+        self.target = type(service).__name__
+        self.service = service
+        self.parentType = parentType
+        self.steps = dict((key, self._CompileStep(service, key, value, parentType)) for key, value in template.items())
+
+    @staticmethod
+    def _MergeTemplates(templates):
+        ''' Union of the keys of the list item dictionaries, nested dictionaries are merged as well '''
+
+        merged = {}
+        for template in templates:
+            for key, value in template.items():
+                if type(value) is dict and type(merged.get(key)) is dict:
+                    value = WebServiceMessagePlan._MergeTemplates([merged[key], value])
+                elif type(value) is list and len(value) > 0 and type(value[0]) is dict and type(merged.get(key)) is list:
+                    value = merged[key] + value
+                merged[key] = value
+        return merged
+
+    def _CompileStep(self, service, key, value, parentType):
+        ''' Returns (kind, accessor, constructor, plan, elementType) '''
+
+        accessor = None
+        if parentType is not None:
+            fieldName = key.split("->")[0].strip()
+            accessor = WebServiceRequestBuilder._GetStrictAccessorForType(parentType, fieldName)
+
+        if type(value) is dict:
+            typeName = key.split("->")[1].strip() if "->" in key else key
+            typeIndex = WebServiceRequestBuilder.GetTypeIndex(service)
+            instanceType = typeIndex.GetInstanceType(typeName)
+            self.resultType = instanceType
+            return (WebServiceMessagePlan.OBJECT, accessor, typeIndex.GetConstructor(instanceType), WebServiceMessagePlan(service, value, instanceType), None)
+
+        if accessor is None:
+            from CustomException import CustomException
+            raise CustomException("Value of '{0}' can only be set on a parent object".format(key))
+
+        if type(value) is list and len(value) > 0 and type(value[0]) is dict:
+            itemPlan = WebServiceMessagePlan(service, WebServiceMessagePlan._MergeTemplates(value))  # all items share one plan
+            return (WebServiceMessagePlan.OBJECT_LIST, accessor, None, itemPlan, itemPlan.resultType)
+
+        if type(value) is list:
+            elementType = accessor.memberType.GetElementType() if accessor.memberType.IsArray else None
+            return (WebServiceMessagePlan.LIST, accessor, None, None, elementType)
+
+        return (WebServiceMessagePlan.VALUE, accessor, None, None, None)
+
+    def Build(self, values, parent=None):
+        ''' Create the .NET object(s) for values, returns the same object as ProcessMessage would '''
+
+        start = time.time()
+        try:
+            return self._Build(values, parent)
+        finally:
+            Instrumentation.Observe("soap", self.target, "Build", "serialize", time.time() - start)
+
+    def _Build(self, values, parent=None):
+
+        newObject = None
+
+        for key, value in values.items():
+            step = self.steps.get(key)
+            if step is None:  # not in the template
+                step = self.steps[key] = self._CompileStep(self.service, key, value, self.parentType)
+            kind, accessor, constructor, plan, elementType = step
+
+            if kind == WebServiceMessagePlan.OBJECT:
+                newObject = constructor()
+                plan._Build(value, newObject)
+                if parent is not None:
+                    accessor.Set(parent, newObject)
+
+            elif kind == WebServiceMessagePlan.OBJECT_LIST:
+                items = [plan._Build(item) for item in value]
+                accessor.Set(parent, WebServiceMessagePlan._ToArray(items, elementType))
+
+            elif kind == WebServiceMessagePlan.LIST:
+                accessor.Set(parent, WebServiceMessagePlan._ToArray(value, elementType))
+
+            else:
+                accessor.Set(parent, value)
+
+        return newObject
+
+    @staticmethod
+    def _ToArray(items, elementType):
+
+        if elementType is None or len(items) == 0:
+            return WebServiceRequestBuilder._ConvertListToGenericArray(items)
+        return System.Array[elementType](items)
+
+    def BuildMany(self, valuesList):
+        ''' Build a message for each dictionary, ex: one per line item '''
+
+        start = time.time()
+        try:
+            return [self._Build(values) for values in valuesList]
+        finally:
+            Instrumentation.Observe("soap", self.target, "Build", "serialize", time.time() - start)
+
+
+class WebServiceAssemblyCache:
+    '''
+        Optional persistent cache of generated web service assemblies, keyed by a hash of the wsdl content
+        Later processes load the assembly from disk instead of generating code, enable it with:
+
+        > WebServiceRequestBuilder.assemblyCache = WebServiceAssemblyCache(r"C:\\temp\\wsdl-assemblies")
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def Load(self, wsdlUrl, username, password):
+        '''
+            Return a service proxy instance, generating (and storing) the assembly only for unknown wsdl content
+            Errors downloading the wsdl are raised, None is returned when the cache itself fails (see WebServiceRequestBuilder._LoadService)
+        '''
+
+        from System.Net import NetworkCredential
+        from System import Activator
+
+        wsdl = WebServiceAssemblyCache._Download(wsdlUrl, username, password)
+
+        try:
+            service = Activator.CreateInstance(WebServiceAssemblyCache._GetProxyType(self._GetAssembly(wsdl)))
+        except Exception as e:
+            Log.Write("Web service assembly cache failed, loading without cache: {0}".format(e))
+            Instrumentation.Count("soap.assemblycache.errors")
+            return None
+
+        service.Credentials = NetworkCredential(username, password)
+        return service
+
+    def _GetAssembly(self, wsdl):
+        ''' Load the stored assembly, or generate it into a temporary file that is moved into place once complete '''
+
+        from System import Guid
+        from System.IO import Directory, File, IOException, Path
+        from System.Reflection import Assembly
+
+        path = Path.Combine(self.directory, WebServiceAssemblyCache._Hash(wsdl) + ".dll")
+        if File.Exists(path):
+            return Assembly.LoadFrom(path)
+
+        Directory.CreateDirectory(self.directory)
+        temporaryPath = "{0}.{1}.tmp.dll".format(path[:-len(".dll")], Guid.NewGuid().ToString("N"))
+        try:
+            WebServiceAssemblyCache._Generate(wsdl, temporaryPath)
+            File.Move(temporaryPath, path)  # other processes never see a partially written assembly
+        except IOException:
+            if not File.Exists(path):  # otherwise another process stored the same assembly first
+                raise
+        finally:
+            if File.Exists(temporaryPath):
+                File.Delete(temporaryPath)
+
+        return Assembly.LoadFrom(path)
+
+    @staticmethod
+    def _Download(wsdlUrl, username, password):
+        from Helper import Helper, CPQ
+
+        credentialsEncoded = Helper.Python.EncodeCredentialsForBasicAuthentication(username, password)
+        response = Helper.Python.HttpGet(wsdlUrl, credentialsEncoded)
+
+        stream = CPQ.StreamReader(response.GetResponseStream())
+        wsdl = stream.ReadToEnd()
+        stream.Close()
+
+        return wsdl
+
+    @staticmethod
+    def _Hash(content):
+        from System import BitConverter
+        from System.Security.Cryptography import SHA256
+        from System.Text import Encoding
+
+        digest = SHA256.Create().ComputeHash(Encoding.UTF8.GetBytes(content))
+        return BitConverter.ToString(digest).Replace("-", "").lower()
+
+    @staticmethod
+    def _Generate(wsdl, path):
+        ''' Generate the client proxy code for the wsdl and compile it into an assembly stored at path (not loaded) '''
+
+        clr.AddReference("System.Web.Services")
+        from System.CodeDom import CodeCompileUnit, CodeNamespace
+        from System.CodeDom.Compiler import CompilerParameters
+        from System.IO import StringReader
+        from System.Web.Services.Description import ServiceDescription, ServiceDescriptionImporter, ServiceDescriptionImportStyle
+        from Microsoft.CSharp import CSharpCodeProvider
+
+        importer = ServiceDescriptionImporter()
+        importer.AddServiceDescription(ServiceDescription.Read(StringReader(wsdl)), None, None)
+        importer.Style = ServiceDescriptionImportStyle.Client
+
+        codeNamespace = CodeNamespace()
+        unit = CodeCompileUnit()
+        unit.Namespaces.Add(codeNamespace)
+        importer.Import(codeNamespace, unit)
+
+        parameters = CompilerParameters(System.Array[str](["System.dll", "System.Xml.dll", "System.Web.Services.dll"]))
+        parameters.GenerateInMemory = False
+        parameters.OutputAssembly = path
+
+        results = CSharpCodeProvider().CompileAssemblyFromDom(parameters, unit)
+        if results.Errors.HasErrors:
+            from CustomException import CustomException
+            raise CustomException("Could not generate web service assembly - first error: {0}".format(results.Errors[0].ErrorText))
+
+    @staticmethod
+    def _GetProxyType(assembly):
+
+        clr.AddReference("System.Web.Services")
+        from System.Web.Services.Protocols import SoapHttpClientProtocol
+
+        for instanceType in assembly.GetTypes():
+            if clr.GetClrType(SoapHttpClientProtocol).IsAssignableFrom(instanceType):
+                return instanceType
+        from CustomException import CustomException
+        raise CustomException("No service proxy found in assembly '{0}'".format(assembly.FullName))
+
+
+class WebServiceCatalog:
+    '''
+        Index of the wsil description (/sap/ap/srt/wsil) in C4C: objname -> wsdl location
+        The wsil is parsed once while streaming it from the response, catalogs are cached per SAPID & user with a TTL
+    '''
+
+    ttl = 3600  # seconds
+    namespace = "http://schemas.xmlsoap.org/ws/2001/10/inspection/"
+
+    _catalogs = {}  # (SAPID, username) -> WebServiceCatalog
+
+    def __init__(self, reader):
+        ''' Build index from a XmlReader positioned at the start of the wsil document '''
+
+        from System.Xml import XmlNodeType
+
+        self.created = time.time()
+        self.locations = {}  # objname -> wsdl location, first service wins
+        self.services = []  # (abstract, wsdl location) in document order, for keys that are not an exact objname
+
+        abstract, location = None, None
+        while reader.Read():
+            if reader.NamespaceURI != WebServiceCatalog.namespace:
+                continue
+            if reader.NodeType == XmlNodeType.Element:
+                if reader.LocalName == "service":
+                    abstract, location = None, None
+                elif reader.LocalName == "abstract":
+                    abstract = reader.ReadString()
+                elif reader.LocalName == "description" and location is None:
+                    location = reader.GetAttribute("location")
+            elif reader.NodeType == XmlNodeType.EndElement and reader.LocalName == "service":
+                self._Add(abstract, location)
+
+    def _Add(self, abstract, location):
+
+        if abstract is None or location is None:
+            return
+
+        self.services.append((abstract, location))
+        if "objname=" in abstract:
+            # example abstract: ...objname=Query Sales Quotes;...
+            objname = abstract.split("objname=")[1]
+            for delimiter in (";", "&", "\n", "\r"):
+                objname = objname.split(delimiter)[0]
+            self.locations.setdefault(objname.strip(), location)
+
+    def GetLocation(self, key):
+        ''' Location of wsdl for the key (example key: Query Sales Quotes), None if the key is unknown '''
+
+        location = self.locations.get(key)
+        if location is not None:
+            return location
+
+        # same semantics as xpath contains(text(), "objname=<key>")
+        condition = "objname=" + key
+        for abstract, location in self.services:
+            if condition in abstract:
+                self.locations[key] = location
+                return location
+
+        return None
+
+    @staticmethod
+    def Get(username, password, SAPID, refresh=False):
+        ''' Get cached catalog, downloading the wsil when missing, expired or refresh is requested '''
+
+        cacheKey = (SAPID, username)
+        catalog = WebServiceCatalog._catalogs.get(cacheKey)
+        if catalog is None or refresh or catalog.created + WebServiceCatalog.ttl < time.time():
+            catalog = WebServiceCatalog._Download(username, password, SAPID)
+            WebServiceCatalog._catalogs[cacheKey] = catalog
+        return catalog
+
+    @staticmethod
+    def _Download(username, password, SAPID):
+        '''Send request to C4C to get full description of available web service descriptions (wsdl)'''
+
+        clr.AddReference("System.Xml")
+        from System.Xml import XmlReader, XmlReaderSettings
+        from Helper import Helper
+
+        # Create encoded credentials object
+        credentialsEncoded = Helper.Python.EncodeCredentialsForBasicAuthentication(username, password)
+
+        # Send request with credentials
+        url = "https://my{0}.crm.ondemand.com/sap/ap/srt/wsil".format(SAPID)
+        response = Helper.Python.HttpGet(url, credentialsEncoded)
+
+        # Parse xml while reading the response stream, closing the reader closes the stream
+        settings = XmlReaderSettings()
+        settings.CloseInput = True
+        try:
+            reader = XmlReader.Create(response.GetResponseStream(), settings)
+            try:
+                return WebServiceCatalog(reader)
+            finally:
+                reader.Close()
+        finally:
+            response.Close()  # releases the connection to c4c
 
 
 class WebServiceRequestBuilder:
 
+    assemblyCache = None  # optional WebServiceAssemblyCache, used instead of CPQ.WebServiceHelper.Load
+
+    _services = {}  # (key, wsdl, username) -> loaded service
+    _serviceStats = {"hits": 0, "loads": 0, "loadSeconds": {}}  # loadSeconds: key -> seconds of the last load
+
+    _typeIndexes = {}  # assembly -> WebServiceTypeIndex
+    _accessors = {}  # (Type, member name) -> WebServiceMemberAccessor, None when the member does not exist
+
     @staticmethod
     def ProcessMessage(service, dictionary, parent=None):
         '''
@@ -31,8 +490,21 @@ class WebServiceRequestBuilder:
             > WebServiceRequestBuilder.ProcessMessage(service, {"query": {"property": "value" }})
 
             if the value is another python dictionary, it should be in the same format as described here
+            The duration is observed as the "serialize" phase of the service (see Invoke for the "network" phase)
         '''
 
+        if parent is not None:
+            return WebServiceRequestBuilder._ProcessMessage(service, dictionary, parent)
+
+        start = time.time()
+        try:
+            return WebServiceRequestBuilder._ProcessMessage(service, dictionary)
+        finally:
+            Instrumentation.Observe("soap", type(service).__name__, "ProcessMessage", "serialize", time.time() - start)
+
+    @staticmethod
+    def _ProcessMessage(service, dictionary, parent=None):
+
         newObject = None
 
         # Simply process each key value pair in the dictionary
@@ -44,7 +516,7 @@ class WebServiceRequestBuilder:
                 newObject = WebServiceRequestBuilder.New(service, key)
 
                 # Process value recursively
-                WebServiceRequestBuilder.ProcessMessage(service, value, newObject)
+                WebServiceRequestBuilder._ProcessMessage(service, value, newObject)
 
                 # Set field on parent if parent exists
                 if parent is not None:
@@ -56,7 +528,7 @@ class WebServiceRequestBuilder:
                 if type(value) is list and len(value) > 0 and type(value[0]) is dict:
 
                     # Handle recursively for each item in list using a map function
-                    processedList = [WebServiceRequestBuilder.ProcessMessage(service, property) for property in value]
+                    processedList = [WebServiceRequestBuilder._ProcessMessage(service, property) for property in value]
 
                     # Convert list to generic .NET type and set field on parent
                     WebServiceRequestBuilder._ProcessField(parent, key, WebServiceRequestBuilder._ConvertListToGenericArray(processedList))
@@ -74,6 +546,17 @@ class WebServiceRequestBuilder:
 
         return newObject
 
+    @staticmethod
+    def Compile(service, template):
+        '''
+            Compile a ProcessMessage dictionary into a reusable plan, for messages that are built repeatedly with the same shape
+
+            > plan = WebServiceRequestBuilder.Compile(service, {"query": {"property -> propertytype": "value" }})
+            > query = plan.Build({"query": {"property -> propertytype": "other value" }})
+        '''
+
+        return WebServiceMessagePlan(service, template)
+
     @staticmethod
     def New(service, typeName, **kwargs):
         ''' Create new instance using reflection, **this is necessary**(!) because of namespace collisions in generated C4C web service assemblies'''
@@ -82,60 +565,73 @@ class WebServiceRequestBuilder:
             typeName = typeName.split("->")[1].strip()
 
         # create instance
-        assembly = clr.GetClrType(type(service)).Assembly
-        try:
-            instanceType = assembly.GetTypes().First(lambda x: x.Name == typeName)
-        except SystemError:
-            raise CustomException("Type '{0}' does not exist in this assembly".format(typeName))
-        from System import Activator
-        instance = Activator.CreateInstance(instanceType)
+        typeIndex = WebServiceRequestBuilder.GetTypeIndex(service)
+        instanceType = typeIndex.GetInstanceType(typeName)
+        instance = typeIndex.CreateInstance(instanceType)
 
         # set provided kwargs as fields on the newly created object
         if kwargs is not None:
-            for key, value in kwargs.iteritems():
+            for key, value in kwargs.items():
                 field = instanceType.GetField(key)
                 field.SetValue(instance, value)
 
         return instance
 
+    @staticmethod
+    def GetTypeIndex(service):
+        ''' Get the type index of the service assembly, BuildSeconds and Size show the cost of building it '''
+
+        assembly = clr.GetClrType(type(service)).Assembly
+        typeIndex = WebServiceRequestBuilder._typeIndexes.get(assembly)
+        if typeIndex is None:
+            typeIndex = WebServiceTypeIndex(assembly)
+            WebServiceRequestBuilder._typeIndexes[assembly] = typeIndex
+        return typeIndex
+
     @staticmethod
     def _ProcessField(instance, field, value):
-        ''' Process field to set the value supporting '->' syntax '''
+        ''' Process field to set the value supporting '->' syntax, field 'Specified' is set if it exists '''
 
         # Get actual fieldname (without type)
         if "->" in field:
             field = field.split("->")[0].strip()
 
-        WebServiceRequestBuilder._SetField(instance, field, value, True)
+        WebServiceRequestBuilder._GetStrictAccessor(instance, field).Set(instance, value)
 
-        # Set field 'Specified' if exists
-        field = field + 'Specified'
+    @staticmethod
+    def _GetStrictAccessor(instance, field):
+        return WebServiceRequestBuilder._GetStrictAccessorForType(instance.GetType(), field)
+
+    @staticmethod
+    def _GetStrictAccessorForType(instanceType, field):
 
-        WebServiceRequestBuilder._SetField(instance, field, True, False)
+        accessor = WebServiceRequestBuilder._GetAccessor(instanceType, field)
+        if accessor is None:
+            from CustomException import CustomException
+            raise CustomException("Could not get fieldInfo for instance of type '{0}' with field '{1}'".format(instanceType.Name, field))
+        return accessor
 
     @staticmethod
-    def _SetField(instance, field, value, strict):
-        '''Use reflection to set a field value or property value on an object'''
+    def _GetAccessor(instanceType, field):
+        ''' Resolve field (or fallback property) once per type, missing members are cached as None '''
 
-        # Get Field
-        instanceType = instance.GetType()
-        fieldInfo = instanceType.GetField(field)  # try to get as field
-        if fieldInfo is None:
-            fieldInfo = instanceType.GetProperty(field)  # fallback on property
-            if fieldInfo is None and strict:
-                typeName = type(instance).__name__
-                raise CustomException("Could not get fieldInfo for instance of type '{0}' with field '{1}'".format(typeName, field))
-            elif fieldInfo is None:
-                return
+        key = (instanceType, field)
+        if key in WebServiceRequestBuilder._accessors:
+            return WebServiceRequestBuilder._accessors[key]
 
-        # Set field
-        try:
-            fieldInfo.SetValue(instance, value)
-        except ValueError as e:
-            typeName = type(instance).__name__
-            raise CustomException("Could not set field '{0}' for instance of type '{1}' - innerexception: {2} ".format(field, typeName, e.message))
+        memberInfo = instanceType.GetField(field)  # try to get as field
+        if memberInfo is None:
+            memberInfo = instanceType.GetProperty(field)  # fallback on property
+
+        accessor = None
+        if memberInfo is not None:
+            specified = None
+            if not field.endswith("Specified"):
+                specified = WebServiceRequestBuilder._GetAccessor(instanceType, field + "Specified")
+            accessor = WebServiceMemberAccessor(memberInfo, specified)
 
-        return
+        WebServiceRequestBuilder._accessors[key] = accessor
+        return accessor
 
     @staticmethod
     def _ConvertListToGenericArray(list):
@@ -152,62 +648,123 @@ class WebServiceRequestBuilder:
         '''
             Generate .NET assembly based on wsdl description that is found through a custom table lookup with the provided key.
             If the URL does not work, the correct URL will be retrieved from the wsil description (/sap/ap/srt/wsil) in C4S.
+            Loaded services are cached in-process per key, wsdl & user (see also WebServiceAssemblyCache).
         '''
+        from Mappings import Mappings
+
         query = "SELECT * FROM {0} WHERE name = '{1}'".format(Mappings.CustomTables.WebServices, key)
         record = SqlHelper.GetFirst(query)
+
+        service = WebServiceRequestBuilder._services.get((key, record.wsdl, username))
+        if service is not None:
+            WebServiceRequestBuilder._serviceStats["hits"] += 1
+            Instrumentation.Count("soap.service.cache.hits")
+            return service
+
+        start = time.time()
+        wsdl = record.wsdl
         try:
 
-            # Return service class from generated assembly
-            return CPQ.WebServiceHelper.Load('wsdl', record.wsdl, username, password)
+            # Load service class from generated assembly
+            service = WebServiceRequestBuilder._LoadService(wsdl, username, password)
         except:  # noqa E722
 
-            Log.Write("Could not load webservice, fetching wsdl location from wsil")
+            Log.Write("Could not load webservice, fetching wsdl locations from wsil")
 
-            wsilXmlString = WebServiceRequestBuilder._GetWsil(username, password, SAPID)  # Get wsil
-            wsdl = WebServiceRequestBuilder._GetWsdlLocation(wsilXmlString, key)  # Get wsdl location from wsil
+            # Other services are most likely stale as well (ex: after a tenant upgrade), fix them all at once
+            wsdl = WebServiceRequestBuilder.RefreshWsdlLocations(username, password, SAPID, wsdl).get(key, wsdl)
 
-            Log.Write("wsil xml retrieved, saving wsdl location and retrying loading service with fresh URL")
+            Log.Write("wsil xml retrieved, saved wsdl locations and retrying loading service with fresh URL")
 
-            # Save new location in custom table
-            tableInfo = SqlHelper.GetTable(Mappings.CustomTables.WebServices)
-            tablerow = {"CpqTableEntryId": record.CpqTableEntryId, "name": key, "wsdl": wsdl}
-            tableInfo.AddRow(tablerow)
-            SqlHelper.Upsert(tableInfo)
+            # Load service class from generated assembly
+            service = WebServiceRequestBuilder._LoadService(wsdl, username, password)
+
+        duration = time.time() - start
+        WebServiceRequestBuilder._services[(key, wsdl, username)] = service
+        WebServiceRequestBuilder._serviceStats["loads"] += 1
+        WebServiceRequestBuilder._serviceStats["loadSeconds"][key] = duration
+        Instrumentation.Observe("soap", key, "GetService", "load", duration)
 
-            # Return service class from generated assembly
-            return CPQ.WebServiceHelper.Load('wsdl', wsdl, username, password)
+        return service
 
     @staticmethod
-    def _GetWsil(username, password, SAPID):
-        '''Send request to C4C to get full description of available web service descriptions (wsdl)'''
+    def Invoke(service, operation, *args):
+        '''
+            Call a web service operation and record its duration, slow or sampled calls are logged
+            The "network" phase includes the envelope (de)serialization of the proxy, building the message is the "serialize" phase
+            > WebServiceRequestBuilder.Invoke(service, "FindByElements", query)
+        '''
 
-        # Create encoded credentials object
-        credentialsEncoded = Helper.Python.EncodeCredentialsForBasicAuthentication(username, password)
+        target = type(service).__name__
+        start = time.time()
+        try:
+            return getattr(service, operation)(*args)
+        finally:
+            duration = time.time() - start
+            Instrumentation.Observe("soap", target, operation, "network", duration)
+            if Instrumentation.ShouldLogBodies(duration):
+                Log.Write("--SOAP CALL (sampled) [{0}s]--\n\n{1}.{2}".format(str(duration), target, operation))
 
-        # Send request with credentials
-        url = "https://my{0}.crm.ondemand.com/sap/ap/srt/wsil".format(SAPID)
-        response = Helper.Python.HttpGet(url, credentialsEncoded)
+    @staticmethod
+    def _LoadService(wsdl, username, password):
 
-        # Process stream to read out XML as string
-        stream = CPQ.StreamReader(response.GetResponseStream())
-        fullXmlString = stream.ReadToEnd()
-        stream.Close()
+        if WebServiceRequestBuilder.assemblyCache is not None:
+            service = WebServiceRequestBuilder.assemblyCache.Load(wsdl, username, password)
+            if service is not None:
+                return service  # cache failures fall back on CPQ, only wsdl errors reach the stale wsdl handling of GetService
+
+        from Helper import CPQ
+        return CPQ.WebServiceHelper.Load('wsdl', wsdl, username, password)
+
+    @staticmethod
+    def WarmUp(keys, username, password, SAPID):
+        ''' Preload services, returns the load time in seconds per key (None if loading failed) '''
+
+        loadSeconds = {}
+        for key in keys:
+            start = time.time()
+            try:
+                WebServiceRequestBuilder.GetService(key, username, password, SAPID)
+                loadSeconds[key] = time.time() - start
+            except Exception as e:
+                Log.Write("Could not preload webservice '{0}': {1}".format(key, e))
+                loadSeconds[key] = None
+        return loadSeconds
+
+    @staticmethod
+    def GetServiceStats():
+        ''' Cache hits, amount of loads and load time in seconds per key '''
 
-        return fullXmlString
+        stats = dict(WebServiceRequestBuilder._serviceStats)
+        stats["loadSeconds"] = dict(stats["loadSeconds"])
+        stats["cached"] = len(WebServiceRequestBuilder._services)
+        return stats
 
     @staticmethod
-    def _GetWsdlLocation(wsilXmlString, key):
-        '''Parse location of wsdl from the wsil xml string, the key should correspond to the value in the wsil xml document'''
+    def RefreshWsdlLocations(username, password, SAPID, staleWsdl=None):
+        '''
+            Update the wsdl location of every service in the custom table using the wsil catalog, in one bulk upsert
+            When the cached catalog still contains the stale wsdl, the wsil is downloaded again
+            Returns the changed locations (name -> wsdl)
+        '''
+        from Mappings import Mappings
 
-        xmlDoc = XmlDocument()
-        xmlDoc.LoadXml(wsilXmlString)
+        records = SqlHelper.GetList("SELECT * FROM {0}".format(Mappings.CustomTables.WebServices))
 
-        manager = XmlNamespaceManager(xmlDoc.NameTable)
-        manager.AddNamespace("wsil", "http://schemas.xmlsoap.org/ws/2001/10/inspection/")
+        catalog = WebServiceCatalog.Get(username, password, SAPID)
+        if staleWsdl is not None and staleWsdl in [location for _, location in catalog.services]:
+            catalog = WebServiceCatalog.Get(username, password, SAPID, True)
 
-        # example key: Query Sales Quotes
-        condition = 'wsil:abstract[contains(text(),"objname={0}")]'.format(key)
-        xpathQuery = '/wsil:inspection/wsil:service[{0}]/wsil:description/@location'.format(condition)
+        changed = {}
+        tableInfo = SqlHelper.GetTable(Mappings.CustomTables.WebServices)
+        for record in records:
+            wsdl = catalog.GetLocation(record.name)
+            if wsdl is not None and wsdl != record.wsdl:
+                tableInfo.AddRow({"CpqTableEntryId": record.CpqTableEntryId, "name": record.name, "wsdl": wsdl})
+                changed[record.name] = wsdl
+
+        # Save new locations in custom table
+        if len(changed) > 0:
+            SqlHelper.Upsert(tableInfo)
 
-        locationAttribute = xmlDoc.SelectSingleNode(xpathQuery, manager)
-        return locationAttribute.Value
+        return changed
@@ -0,0 +1,329 @@
+'''
+    Minimal stand-ins for the CLR / CPQ dependencies of the C4C modules, only used by the benchmarks
+    They provide just enough to import the modules and time the pure python serialization & parsing paths
+    on CPython (Linux), they are NOT a replacement for the real .NET types:
+
+    - System.Linq.Expressions is not available, so compiled constructors & setters fall back on Activator & reflection
+    - System.Net.WebRequest is not available, use benchmarks.http_transport.HttpTransport as Odata transport
+    - generated web service assemblies are emulated with ClrObject subclasses (see ClrObject)
+'''
+
+import base64
+import json
+import sys
+import threading
+import time
+import types
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+try:
+    from urllib import quote_plus
+except ImportError:
+    from urllib.parse import quote_plus
+
+
+class _Generic(object):
+    ''' Subscriptable stand-in for generic .NET types, ex: Func[object](fn) -> fn, Array[T](items) -> list '''
+
+    def __init__(self, create):
+        self._create = create
+
+    def __getitem__(self, types):
+        return self._create
+
+
+class _Unavailable(object):
+    ''' Every attribute raises, makes the modules take their fallback path (ex: Expression -> reflection) '''
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        raise NotImplementedError("{0}.{1} is not available outside of the CLR".format(self._name, name))
+
+
+class ClrType(object):
+    ''' System.Type stand-in for a python class, one instance per class so it can be used as dictionary key '''
+
+    _types = {}
+    _lock = threading.Lock()
+
+    def __init__(self, pythonType, elementType=None):
+        self.pythonType = pythonType
+        self.Name = pythonType.__name__ if elementType is None else elementType.Name + "[]"
+        self.IsArray = elementType is not None
+        self._elementType = elementType
+
+    @staticmethod
+    def Of(pythonType):
+        with ClrType._lock:
+            clrType = ClrType._types.get(pythonType)
+            if clrType is None:
+                clrType = ClrType._types[pythonType] = ClrType(pythonType)
+            return clrType
+
+    @staticmethod
+    def ArrayOf(elementType):
+        key = ("array", elementType)
+        with ClrType._lock:
+            clrType = ClrType._types.get(key)
+            if clrType is None:
+                clrType = ClrType._types[key] = ClrType(list, elementType)
+            return clrType
+
+    @property
+    def Assembly(self):
+        return Assembly.Of(sys.modules[self.pythonType.__module__])
+
+    def GetElementType(self):
+        return self._elementType
+
+    def GetField(self, name):
+        fields = getattr(self.pythonType, "fields", {})
+        if name not in fields:
+            return None
+        fieldType = fields[name]
+        fieldType = ClrType.ArrayOf(ClrType.Of(fieldType[0])) if type(fieldType) is list else ClrType.Of(fieldType)
+        return FieldInfo(name, fieldType, self)
+
+    def GetProperty(self, name):
+        return None
+
+    def CreateInstance(self):
+        return self.pythonType()
+
+
+class Assembly(object):
+    ''' Assembly stand-in for a python module, its types are the ClrObject subclasses defined in the module '''
+
+    _assemblies = {}
+
+    def __init__(self, module):
+        self.module = module
+        self.FullName = module.__name__
+
+    @staticmethod
+    def Of(module):
+        assembly = Assembly._assemblies.get(module.__name__)
+        if assembly is None:
+            assembly = Assembly._assemblies[module.__name__] = Assembly(module)
+        return assembly
+
+    def GetTypes(self):
+        members = [getattr(self.module, name) for name in sorted(dir(self.module))]
+        return [ClrType.Of(member) for member in members
+                if isinstance(member, type) and issubclass(member, ClrObject) and member.__module__ == self.module.__name__]
+
+
+class ClrObject(object):
+    '''
+        Base class for emulated generated web service types, fields are declared as name -> python type
+        ex: fields = {"ID": str, "Item": [SalesOrderItem], "QuantitySpecified": bool}
+    '''
+
+    fields = {}
+
+    def GetType(self):
+        return ClrType.Of(type(self))
+
+
+class FieldInfo(object):
+
+    def __init__(self, name, fieldType, declaringType):
+        self.Name = name
+        self.FieldType = fieldType
+        self.DeclaringType = declaringType
+
+    def SetValue(self, instance, value):
+        setattr(instance, self.Name, value)
+
+
+class Activator:
+
+    @staticmethod
+    def CreateInstance(instanceType):
+        return instanceType.CreateInstance()
+
+
+class Guid:
+
+    @staticmethod
+    def NewGuid():
+        import uuid
+        return uuid.uuid4()
+
+
+class HttpUtility:
+
+    @staticmethod
+    def UrlEncode(value):
+        return quote_plus(str(value))
+
+
+class _Encoding(object):
+
+    def GetBytes(self, value):
+        return bytearray(value.encode("utf-8"))
+
+    def GetByteCount(self, value):
+        return len(value.encode("utf-8"))
+
+    def GetString(self, value):
+        return bytes(value).decode("utf-8")
+
+
+class Encoding:
+    UTF8 = _Encoding()
+
+
+class WebException(Exception):
+
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.Response = response
+
+
+class Task(object):
+    ''' Thread based stand-in for System.Threading.Tasks.Task '''
+
+    def __init__(self, function):
+        self._function = function
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _run(self):
+        try:
+            self._result = self._function()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    @property
+    def IsCompleted(self):
+        return self._done.is_set()
+
+    @property
+    def Result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def GetAwaiter(self):
+        return self
+
+    def GetResult(self):
+        return self.Result
+
+    @staticmethod
+    def WaitAny(tasks):
+        while True:
+            for i, task in enumerate(tasks):
+                if task.IsCompleted:
+                    return i
+            time.sleep(0.0005)
+
+    class Factory:
+
+        @staticmethod
+        def StartNew(function):
+            task = Task(function)
+            thread = threading.Thread(target=task._run)
+            thread.daemon = True
+            thread.start()
+            return task
+
+
+class JsonObject(dict):
+    ''' Json object with attribute access, like the objects returned by RestClient.DeserializeJson '''
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class RestClient:
+
+    @staticmethod
+    def DeserializeJson(value):
+        return json.loads(value, object_hook=JsonObject)
+
+
+class Log:
+    messages = 0
+
+    @staticmethod
+    def Write(message):
+        Log.messages += 1
+
+
+class Utility:
+
+    @staticmethod
+    def ExecuteAndTimeAction(function, *args):
+        start = time.time()
+        result = function(*args)
+        return (result, time.time() - start)
+
+
+class Python:
+
+    @staticmethod
+    def EncodeCredentialsForBasicAuthentication(username, password):
+        return base64.b64encode("{0}:{1}".format(username, password).encode("utf-8")).decode("ascii")
+
+
+def _module(name, **members):
+    module = types.ModuleType(name)
+    module.__dict__.update(members)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    ''' Register the stand-in modules & builtins, does nothing when running in IronPython (real CLR available) '''
+
+    if sys.platform == "cli" or "System" in sys.modules:
+        return
+
+    class Object(object):
+        pass
+
+    _module("clr", AddReference=lambda *names: None, GetClrType=lambda pythonType: ClrType.Of(pythonType))
+    system = _module("System", Object=Object, Guid=Guid, Activator=Activator, Func=_Generic(lambda function: function),
+                     Action=_Generic(lambda function: function), Array=_Generic(list))
+    system.Web = _module("System.Web", HttpUtility=HttpUtility)
+    system.IO = _module("System.IO", MemoryStream=_Unavailable("System.IO.MemoryStream"), StreamReader=_Unavailable("System.IO.StreamReader"))
+    system.IO.Compression = _module("System.IO.Compression", CompressionMode=_Unavailable("System.IO.Compression.CompressionMode"),
+                                    DeflateStream=_Unavailable("System.IO.Compression.DeflateStream"),
+                                    GZipStream=_Unavailable("System.IO.Compression.GZipStream"))
+    system.Net = _module("System.Net", WebException=WebException, WebRequest=_Unavailable("System.Net.WebRequest"))
+    system.Text = _module("System.Text", Encoding=Encoding)
+    system.Threading = _module("System.Threading")
+    system.Threading.Tasks = _module("System.Threading.Tasks", Task=Task)
+    system.Linq = _module("System.Linq")
+    system.Linq.Expressions = _module("System.Linq.Expressions", Expression=_Unavailable("System.Linq.Expressions.Expression"))
+    system.Reflection = _module("System.Reflection", FieldInfo=FieldInfo)
+    system.Xml = _module("System.Xml", XmlNodeType=_Unavailable("System.Xml.XmlNodeType"), XmlReader=_Unavailable("System.Xml.XmlReader"))
+
+    class Dynamic(object):
+        pass
+
+    class CustomTables:
+        WebServices = "C4C_WebServices"
+
+    _module("Helper", Helper=type("Helper", (), {"Python": Python, "Utility": Utility}), CPQ=_Unavailable("CPQ"))
+    _module("Objects", Objects=type("Objects", (), {"Dynamic": Dynamic}))
+    _module("Mappings", Mappings=type("Mappings", (), {"CustomTables": CustomTables}))
+    _module("CustomException", CustomException=type("CustomException", (Exception,), {}))
+
+    builtins.Log = Log
+    builtins.RestClient = RestClient
@@ -0,0 +1,313 @@
+'''
+    Local stand-in for the C4C odata service (c4codataapi), used by the benchmarks
+
+    - HEAD on the service root and GET $metadata return a csrf token & session cookie (x-csrf-token: fetch)
+    - GET <EntitySet>Collection returns entities with server-driven paging (d.__next with $skiptoken), $top & $skip are honored
+      a $top above the page size is paged as well, the __next links stay within the $top window
+    - POST $batch answers every operation (changesets included), non-GET requests require the csrf token (403 + Required otherwise)
+
+    Latency (seconds per request) and payload size (bytes of padding per entity) are configurable.
+    Responses are gzip compressed when the client accepts it, gzip / deflate request bodies are decompressed.
+    The response generators are static so the benchmarks can also build batch responses without a server.
+'''
+
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class FakeC4C(object):
+    ''' Fake C4C odata server running in a background thread, use as context manager or Start() / Stop() '''
+
+    servicePath = "/sap/c4c/odata/v1/c4codataapi/"
+    metadata = ('<?xml version="1.0" encoding="utf-8"?><edmx:Edmx Version="1.0" xmlns:edmx="http://schemas.microsoft.com/ado/2007/06/edmx">'
+                '<edmx:DataServices><Schema Namespace="c4codata"/></edmx:DataServices></edmx:Edmx>')
+
+    def __init__(self, latency=0.0, payloadSize=256, entities=1000, pageSize=100, port=0):
+        self.latency = latency
+        self.payloadSize = payloadSize
+        self.entities = entities
+        self.pageSize = pageSize
+        self.port = port
+        self.token = str(uuid.uuid4())
+        self.stats = {"requests": 0, "batches": 0, "operations": 0, "csrfFetches": 0, "csrfFailures": 0, "connections": 0}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._connections = set()  # open keep-alive connections, closed on Stop
+
+    @property
+    def ServiceUrl(self):
+        return "http://127.0.0.1:{0}{1}".format(self._server.server_address[1], FakeC4C.servicePath)
+
+    def Start(self):
+
+        fake = self
+
+        class Handler(_Handler):
+            server_fake = fake
+
+        self._server = _Server(("127.0.0.1", self.port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def Stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+        deadline = time.time() + 1.0  # let the handler threads finish before the interpreter exits
+        while self._connections and time.time() < deadline:
+            time.sleep(0.01)
+
+    def __enter__(self):
+        return self.Start()
+
+    def __exit__(self, *exc):
+        self.Stop()
+
+    def Count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def Entity(index, payloadSize):
+        ''' Entity as c4c returns it, payloadSize characters of padding are added to control the response size '''
+
+        return {
+            "__metadata": {"uri": "Collection('{0:032x}')".format(index), "type": "c4codata.Entity", "etag": "W/\"{0}\"".format(index)},
+            "ObjectID": "{0:032x}".format(index),
+            "ID": str(index),
+            "Name": "Entity {0}".format(index),
+            "Payload": "x" * payloadSize,
+        }
+
+    @staticmethod
+    def Page(entities, nextLink=None):
+        page = {"results": entities}
+        if nextLink is not None:
+            page["__next"] = nextLink
+        return json.dumps({"d": page})
+
+    @staticmethod
+    def OperationResponse(method, index, payloadSize):
+        ''' (status line, body) of a single batch operation '''
+
+        if method == "GET":
+            return ("HTTP/1.1 200 OK", json.dumps({"d": FakeC4C.Entity(index, payloadSize)}))
+        if method == "POST":
+            return ("HTTP/1.1 201 Created", json.dumps({"d": FakeC4C.Entity(index, payloadSize)}))
+        return ("HTTP/1.1 204 No Content", None)
+
+    @staticmethod
+    def BatchResponse(operations, payloadSize):
+        '''
+            Build a batch response body, operations is a list of methods (ex: "GET") or lists of methods (changesets)
+            Returns (content type, body)
+        '''
+
+        boundary = "batchresponse_" + str(uuid.uuid4())
+        buffer = []
+        index = 0
+        for operation in operations:
+            buffer.append("--{0}\r\n".format(boundary))
+            if isinstance(operation, list):
+                changesetBoundary = "changesetresponse_" + str(uuid.uuid4())
+                buffer.append("Content-Type: multipart/mixed; boundary={0}\r\n\r\n".format(changesetBoundary))
+                for method in operation:
+                    buffer.append("--{0}\r\n".format(changesetBoundary))
+                    buffer.append(FakeC4C._OperationPart(method, index, payloadSize))
+                    index += 1
+                buffer.append("--{0}--\r\n".format(changesetBoundary))
+            else:
+                buffer.append(FakeC4C._OperationPart(operation, index, payloadSize))
+                index += 1
+        buffer.append("--{0}--\r\n".format(boundary))
+        return ("multipart/mixed; boundary=" + boundary, "".join(buffer))
+
+    @staticmethod
+    def _OperationPart(method, index, payloadSize):
+
+        statusLine, body = FakeC4C.OperationResponse(method, index, payloadSize)
+        part = "Content-Type: application/http\r\ncontent-transfer-encoding: binary\r\n\r\n{0}\r\n".format(statusLine)
+        if body is None:
+            return part + "Content-Length: 0\r\ndataserviceversion: 2.0\r\n\r\n\r\n"
+        return part + "Content-Type: application/json\r\nContent-Length: {0}\r\ndataserviceversion: 2.0\r\n\r\n{1}\r\n".format(len(body), body)
+
+    @staticmethod
+    def ParseBatchRequest(contentType, body):
+        ''' Methods of the operations in a batch request body, in the format expected by BatchResponse '''
+
+        boundary = contentType.split("boundary=")[1].split(";")[0].strip()
+        operations = []
+        for part in body.split("--" + boundary)[1:]:
+            if part.startswith("--"):
+                break
+            match = re.search(r"multipart/mixed; boundary=([^\s;]+)", part)
+            if match:
+                changeset = []
+                for changesetPart in part.split("--" + match.group(1))[1:]:
+                    if changesetPart.startswith("--"):
+                        break
+                    changeset.extend(FakeC4C._Methods(changesetPart))
+                operations.append(changeset)
+            else:
+                operations.extend(FakeC4C._Methods(part))
+        return operations
+
+    @staticmethod
+    def _Methods(part):
+        return re.findall(r"^(GET|POST|PATCH|PUT|DELETE|MERGE) \S+ HTTP/1\.1", part, re.MULTILINE)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, clientAddress):
+        pass  # clients closing keep-alive connections, or connections closed by Stop
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # keep-alive, the transport should reuse connections
+    server_fake = None
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server_fake.Count("connections")
+        with self.server_fake._lock:
+            self.server_fake._connections.add(self.connection)
+
+    def finish(self):
+        with self.server_fake._lock:
+            self.server_fake._connections.discard(self.connection)
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body="", headers=None, contentType="application/json"):
+
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        if data and "gzip" in self.headers.get("Accept-Encoding", ""):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _begin(self):
+        fake = self.server_fake
+        fake.Count("requests")
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        path = urlparse(self.path).path
+        if not path.startswith(FakeC4C.servicePath):
+            self._send(404, "not found", contentType="text/plain")
+            return None
+        return path[len(FakeC4C.servicePath):]
+
+    def _csrfHeaders(self):
+        ''' Token & session cookie when the client asks for them '''
+
+        if self.headers.get("x-csrf-token", "").lower() != "fetch":
+            return {}
+        self.server_fake.Count("csrfFetches")
+        return {"x-csrf-token": self.server_fake.token, "Set-Cookie": "SAP_SESSIONID=fake; path=/"}
+
+    def do_HEAD(self):
+        if self._begin() is not None:
+            self._send(200, "", self._csrfHeaders())
+
+    def do_GET(self):
+
+        resource = self._begin()
+        if resource is None:
+            return
+        if resource in ("", "$metadata"):
+            self._send(200, FakeC4C.metadata, self._csrfHeaders(), "application/xml")
+            return
+
+        fake = self.server_fake
+        query = dict((key, values[0]) for key, values in parse_qs(urlparse(self.path).query).items())
+        skip = int(query.get("$skiptoken", query.get("$skip", 0)))
+        top = int(query["$top"]) if "$top" in query else None
+
+        count = min(top if top is not None else fake.pageSize, fake.pageSize, max(0, fake.entities - skip))
+        entities = [FakeC4C.Entity(index, fake.payloadSize) for index in range(skip, skip + count)]
+
+        nextLink = None
+        if top is None and skip + count < fake.entities:
+            nextLink = "http://{0}{1}{2}?$skiptoken={3}".format(self.headers.get("Host"), FakeC4C.servicePath, resource, skip + count)
+        elif top is not None and count < top and skip + count < fake.entities:  # $top above the page size, like c4c
+            nextLink = "http://{0}{1}{2}?$top={3}&$skiptoken={4}".format(self.headers.get("Host"), FakeC4C.servicePath, resource, top - count, skip + count)
+
+        self._send(200, FakeC4C.Page(entities, nextLink))
+
+    def do_POST(self):
+
+        resource = self._begin()
+        if resource is None:
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        contentEncoding = self.headers.get("Content-Encoding", "").lower()
+        if contentEncoding == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif contentEncoding == "deflate":
+            body = zlib.decompress(body)
+        body = body.decode("utf-8")
+
+        fake = self.server_fake
+        if self.headers.get("x-csrf-token") != fake.token:
+            fake.Count("csrfFailures")
+            self._send(403, "CSRF token validation failed", {"x-csrf-token": "Required"}, "text/plain")
+            return
+
+        if resource != "$batch":
+            self._send(201, json.dumps({"d": FakeC4C.Entity(0, fake.payloadSize)}))
+            return
+
+        operations = FakeC4C.ParseBatchRequest(self.headers.get("Content-Type", ""), body)
+        fake.Count("batches")
+        fake.Count("operations", sum(len(operation) if isinstance(operation, list) else 1 for operation in operations))
+
+        contentType, response = FakeC4C.BatchResponse(operations, fake.payloadSize)
+        self._send(202, response, contentType=contentType)
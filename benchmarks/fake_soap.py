@@ -0,0 +1,57 @@
+'''
+    Emulated generated web service assembly (sales order maintain service) for the ProcessMessage benchmarks
+'''
+
+from clr_shim import ClrObject
+
+
+class Quantity(ClrObject):
+    fields = {"Value": float, "unitCode": str}
+
+
+class SalesOrderItemProduct(ClrObject):
+    fields = {"ProductID": str, "ProductInternalID": str}
+
+
+class SalesOrderItem(ClrObject):
+    fields = {"ID": str, "Description": str, "ItemProduct": SalesOrderItemProduct, "Quantity": Quantity, "QuantitySpecified": bool,
+              "actionCode": str, "actionCodeSpecified": bool}
+
+
+class SalesOrder(ClrObject):
+    fields = {"BuyerID": str, "Name": str, "DataOriginTypeCode": str, "Item": [SalesOrderItem], "actionCode": str, "actionCodeSpecified": bool}
+
+
+class SalesOrderMaintainRequestBundleMessage(ClrObject):
+    fields = {"SalesOrder": [SalesOrder]}
+
+
+class SalesOrderMaintainService(ClrObject):
+    ''' Service proxy, its assembly is this module '''
+
+
+def Message(items):
+    ''' ProcessMessage dictionary of a sales order with the given amount of items '''
+
+    return {
+        "SalesOrderMaintainRequestBundleMessage": {
+            "SalesOrder": [{
+                "SalesOrder": {
+                    "BuyerID": "CPQ-1", "Name": "Benchmark quote", "DataOriginTypeCode": "4", "actionCode": "01",
+                    "Item": [Item(i) for i in range(items)],
+                }
+            }]
+        }
+    }
+
+
+def Item(index):
+    return {
+        "SalesOrderItem": {
+            "ID": str((index + 1) * 10),
+            "Description": "Item {0}".format(index),
+            "actionCode": "01",
+            "ItemProduct -> SalesOrderItemProduct": {"ProductID": "P-{0}".format(index), "ProductInternalID": "P-{0}".format(index)},
+            "Quantity": {"Value": float(index % 7 + 1), "unitCode": "EA"},
+        }
+    }
@@ -0,0 +1,181 @@
+'''
+    Keep-alive http transport on top of httplib / http.client, stand-in for OdataTransport outside of the CLR
+    Same Send contract: returns a response object (StatusCode, Headers in lowercase, Body, Error, BytesSent, BytesReceived),
+    http errors do not raise. gzip / deflate responses are decompressed, bodies are compressed when Content-Encoding is set.
+    Open streams successful responses like OdataTransport.Open: Reader (readline) instead of Body, closed with Close().
+    As in OdataTransport, the uncompressed size of compressed streamed responses is not known and not counted.
+'''
+
+import codecs
+import gzip
+import io
+import socket
+import threading
+import time
+import zlib
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlparse
+except ImportError:
+    from httplib import HTTPConnection
+    from urlparse import urlparse
+
+
+class HttpError(Exception):
+
+    def __init__(self, response):
+        Exception.__init__(self, "The remote server returned an error: ({0})".format(response.StatusCode))
+        self.Response = response
+
+
+class HttpResponse(object):
+    pass
+
+
+class HttpTransport(object):
+    ''' Idle connections are pooled per host and reused, like the ServicePoint of OdataTransport '''
+
+    def __init__(self, maxConnectionsPerHost=10, timeout=100):
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self.timeout = timeout  # seconds
+        self._idle = {}  # host -> idle connections
+        self._lock = threading.Lock()
+        self.ResetStats()
+
+    def Configure(self, maxConnectionsPerHost):
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+
+    def ResetStats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "errors": 0, "seconds": 0.0, "bytesSent": 0, "bytesReceived": 0,
+                          "bytesSentUncompressed": 0, "bytesReceivedUncompressed": 0, "connections": 0}
+
+    def GetStats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _acquire(self, host):
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop()
+            self.stats["connections"] += 1
+
+        connection = HTTPConnection(host, timeout=self.timeout)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # like UseNagleAlgorithm = False
+        return connection
+
+    def _release(self, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.maxConnectionsPerHost:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def Send(self, method, url, headers, body=None):
+        return self._send(method, url, headers, body, False)
+
+    def Open(self, method, url, headers, body=None):
+        return self._send(method, url, headers, body, True)
+
+    def _send(self, method, url, headers, body, isStreamed):
+
+        start = time.time()
+        parsed = urlparse(url)
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        data = body.encode("utf-8") if body is not None else None
+        uncompressedSent = len(data) if data is not None else 0
+
+        contentEncoding = dict((name.lower(), value) for name, value in headers.items()).get("content-encoding", "").lower()
+        if data is not None and contentEncoding in ("gzip", "deflate"):
+            data = Compress(data, contentEncoding)
+
+        connection = self._acquire(parsed.netloc)
+        try:
+            connection.request(method, path, data, headers)
+            webResponse = connection.getresponse()
+            if isStreamed and webResponse.status < 400:
+                return self._openResponse(parsed.netloc, connection, webResponse, start, data, uncompressedSent)
+            raw = webResponse.read()
+        except Exception:
+            connection.close()
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        self._release(parsed.netloc, connection)
+
+        response = HttpResponse()
+        response.StatusCode = webResponse.status
+        response.Headers = dict((name.lower(), value) for name, value in webResponse.getheaders())
+        uncompressed = Decompress(raw, response.Headers.get("content-encoding", "").lower())
+        response.Body = uncompressed.decode("utf-8")
+        response.Error = HttpError(response) if response.StatusCode >= 400 else None
+        response.BytesSent = len(data) if data is not None else 0
+        response.BytesReceived = len(raw)
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["errors"] += 1 if response.Error is not None else 0
+            self.stats["seconds"] += time.time() - start
+            self.stats["bytesSent"] += response.BytesSent
+            self.stats["bytesReceived"] += response.BytesReceived
+            self.stats["bytesSentUncompressed"] += uncompressedSent
+            self.stats["bytesReceivedUncompressed"] += len(uncompressed)
+
+        return response
+
+
+    def _openResponse(self, host, connection, webResponse, start, data, uncompressedSent):
+        ''' Streamed response, the connection is reused when the body was read completely before Close '''
+
+        response = HttpResponse()
+        response.StatusCode = webResponse.status
+        response.Headers = dict((name.lower(), value) for name, value in webResponse.getheaders())
+        response.Body = None
+        response.Error = None
+        response.BytesSent = len(data) if data is not None else 0
+        response.BytesReceived = int(response.Headers.get("content-length", 0))
+        uncompressedReceived = response.BytesReceived
+
+        stream = webResponse
+        if response.Headers.get("content-encoding", "").lower() == "gzip":  # buffered like OdataTransport
+            compressed = webResponse.read()
+            response.BytesReceived = len(compressed)
+            uncompressedReceived = 0  # not known without counting, not recorded (as OdataTransport)
+            stream = gzip.GzipFile(fileobj=io.BytesIO(compressed))
+        response.Reader = codecs.getreader("utf-8")(stream)
+
+        def close():
+            if webResponse.isclosed():
+                self._release(host, connection)
+            else:
+                connection.close()
+            with self._lock:
+                self.stats["requests"] += 1
+                self.stats["seconds"] += time.time() - start
+                self.stats["bytesSent"] += response.BytesSent
+                self.stats["bytesReceived"] += response.BytesReceived
+                self.stats["bytesSentUncompressed"] += uncompressedSent
+                self.stats["bytesReceivedUncompressed"] += uncompressedReceived
+
+        response.Close = close
+        return response
+
+
+def Compress(data, contentEncoding):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS if contentEncoding == "gzip" else zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def Decompress(data, contentEncoding):
+    if contentEncoding == "gzip":
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if contentEncoding == "deflate":
+        try:
+            return zlib.decompress(data)
+        except zlib.error:  # raw deflate without zlib header
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
@@ -0,0 +1,381 @@
+'''
+    Benchmarks for the serialization & parsing paths of C4C_Odata and C4C_WebServiceRequestBuilder
+
+    Runs on CPython (Linux) using the stand-ins in clr_shim.py, end-to-end cases use a local fake C4C server (fake_c4c.py).
+    Reports throughput (parts per second), p50/p99 latency and peak memory (python 3 only, tracemalloc) per case & size.
+    Import time of the modules is measured in fresh interpreters, C4C_OdataCore without the stand-ins.
+    The modules target IronPython 2.7, cases using python 2 only constructs report an error on python 3.
+
+    > python benchmarks/run.py                                  # all cases, 1 - 5000 parts
+    > python benchmarks/run.py --sizes 1,100 --cases Odata.     # subset
+    > python benchmarks/run.py --save before                    # store baseline in benchmarks/baselines/before.json
+    > python benchmarks/run.py --compare before                 # compare with baseline, exit code 1 on regressions
+    > python benchmarks/run.py --latency 0.05 --payload 2048    # fake server latency (seconds) & entity size (bytes)
+    > python benchmarks/run.py --compression --compress-above 1024  # gzip responses & request bodies from 1024 bytes
+    > python benchmarks/run.py --imports 0                      # skip the import time measurements
+'''
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarkDirectory))
+sys.path.insert(0, benchmarkDirectory)
+
+import clr_shim
+clr_shim.install()
+
+from C4C_Odata import Odata, OdataChangeset, OdataRequest
+from C4C_WebServiceRequestBuilder import WebServiceRequestBuilder
+from fake_c4c import FakeC4C
+from http_transport import HttpTransport
+import fake_soap
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, "perf_counter", time.time)
+
+baselineDirectory = os.path.join(benchmarkDirectory, "baselines")
+
+
+class Config(object):
+    ''' config stand-in, config.environment holds the Odata settings '''
+
+    def __init__(self, serviceUrl, compression=False, compressAbove=None):
+        self.environment = self
+        self.OdataServiceUsername = "benchmark"
+        self.OdataServicePassword = "benchmark"
+        self.SAPID = "000000"
+        self.OdataServiceUrl = serviceUrl
+        self.WebServiceTrafficLogging = False
+        self.OdataMethod = "Sync"
+        self.OdataCompression = compression
+        self.OdataCompressRequestsAbove = compressAbove
+
+
+def Requests(amount):
+    ''' Mix of collection queries and updates, as built by the C4C modules '''
+
+    requests = []
+    for i in range(amount):
+        if i % 3 == 0:
+            query = {"filter": "ExternalID eq 'Q-{0}'".format(i), "select": "ObjectID,ID,Name", "top": "1"}
+            requests.append(OdataRequest(OdataRequest.Method.GET, "OpportunityCollection", query))
+        else:
+            body = json.dumps({"Name": "Item {0}".format(i), "Quantity": str(i), "UnitCode": "EA"})
+            requests.append(OdataRequest(OdataRequest.Method.PATCH, "OpportunityItemCollection('{0:032x}')".format(i), {}, body=body))
+    return requests
+
+
+def BatchRequests(amount, changesetSize=50):
+    ''' GET requests and changesets of PATCH requests, amount operations in total '''
+
+    requests, changes = [], []
+    for i, request in enumerate(Requests(amount)):
+        if request.method == OdataRequest.Method.GET:
+            requests.append(request)
+        else:
+            changes.append(request)
+        if len(changes) == changesetSize or (i == amount - 1 and changes):
+            requests.append(OdataChangeset(changes))
+            changes = []
+    return requests
+
+
+def CaseRequestStr(parts, context):
+    requests = Requests(parts)
+    return lambda: [str(request) for request in requests]
+
+
+def CaseCombineRequests(parts, context):
+    requests = Requests(parts)
+    return lambda: Odata._combineRequests("batch", requests)
+
+
+def CaseParseBatchResponse(parts, context):
+    _, body = FakeC4C.BatchResponse(["GET" if i % 3 == 0 else "POST" for i in range(parts)], context.payload)
+    return lambda: [part.Body for part in Odata._parseBatchResponse(body)]
+
+
+def CaseProcessMessage(parts, context):
+    service = fake_soap.SalesOrderMaintainService()
+    message = fake_soap.Message(parts)
+    return lambda: WebServiceRequestBuilder.ProcessMessage(service, message)
+
+
+def CaseMessagePlan(parts, context):
+    service = fake_soap.SalesOrderMaintainService()
+    message = fake_soap.Message(parts)
+    plan = WebServiceRequestBuilder.Compile(service, message)
+    return lambda: plan.Build(message)
+
+
+def CaseExecuteBatch(parts, context):
+    odata = context.Odata()
+    requests = BatchRequests(parts)
+    return lambda: odata.ExecuteBatch(requests)
+
+
+def CaseIterateBatch(parts, context):
+    odata = context.Odata()
+    requests = BatchRequests(parts)
+    return lambda: sum(1 for _ in odata.IterateBatch(requests))
+
+
+def CaseIterate(parts, context):
+    odata = context.Odata()
+    context.server.entities = parts
+    request = OdataRequest(OdataRequest.Method.GET, "OpportunityCollection", {"select": "ObjectID,ID,Name"})
+    return lambda: sum(1 for _ in odata.Iterate(request))
+
+
+cases = [
+    ("OdataRequest.__str__", CaseRequestStr, False),
+    ("Odata._combineRequests", CaseCombineRequests, False),
+    ("Odata._parseBatchResponse", CaseParseBatchResponse, False),
+    ("WebServiceRequestBuilder.ProcessMessage", CaseProcessMessage, False),
+    ("WebServiceMessagePlan.Build", CaseMessagePlan, False),
+    ("Odata.ExecuteBatch (fake c4c)", CaseExecuteBatch, True),
+    ("Odata.IterateBatch (fake c4c)", CaseIterateBatch, True),
+    ("Odata.Iterate (fake c4c)", CaseIterate, True),
+]
+
+
+# module, needs the stand-ins
+imports = [
+    ("C4C_OdataCore", False),
+    ("C4C_Odata", True),
+    ("C4C_WebServiceRequestBuilder", True),
+]
+
+importScript = '''
+import sys, time
+timer = getattr(time, "perf_counter", time.time)
+sys.path[0:0] = [{root!r}, {benchmarks!r}]
+if {shim!r}:
+    import clr_shim
+    clr_shim.install()
+start = timer()
+import {module}
+print(timer() - start)
+'''
+
+
+def MeasureImport(module, shim, runs):
+    ''' Import time of module in fresh interpreters, excluding interpreter startup '''
+
+    script = importScript.format(root=os.path.dirname(benchmarkDirectory), benchmarks=benchmarkDirectory, shim=shim, module=module)
+    durations = sorted(float(subprocess.check_output([sys.executable, "-c", script]).decode("ascii").strip()) for _ in range(runs))
+    mean = sum(durations) / len(durations)
+    return {"runs": len(durations), "p50": Percentile(durations, 50), "p99": Percentile(durations, 99), "mean": mean, "throughput": None, "peakKb": None}
+
+
+class Context(object):
+    ''' Settings & fake server shared by the cases '''
+
+    def __init__(self, options, server):
+        self.payload = options.payload
+        self.compression = options.compression
+        self.compressAbove = options.compressAbove
+        self.server = server
+        self.transport = HttpTransport()
+
+    def Odata(self):
+        return Odata(Config(self.server.ServiceUrl, self.compression, self.compressAbove), transport=self.transport)
+
+
+def Percentile(values, percentile):
+    ''' Nearest rank percentile of sorted values '''
+
+    rank = max(1, int(round(percentile / 100.0 * len(values) + 0.4999)))
+    return values[min(rank, len(values)) - 1]
+
+
+def PeakMemory(function):
+    ''' Peak allocated KiB while running function once, None when tracemalloc is not available '''
+
+    if tracemalloc is None:
+        return None
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+
+def Measure(function, parts, options):
+
+    durations = []
+    start = timer()
+    while len(durations) < options.runs or (timer() - start < options.seconds and len(durations) < options.maxRuns):
+        runStart = timer()
+        function()
+        durations.append(timer() - runStart)
+
+    durations.sort()
+    mean = sum(durations) / len(durations)
+    return {
+        "runs": len(durations),
+        "p50": Percentile(durations, 50),
+        "p99": Percentile(durations, 99),
+        "mean": mean,
+        "throughput": parts / mean if mean > 0 else None,
+        "peakKb": PeakMemory(function),
+    }
+
+
+def Format(value, format):
+    return "-" if value is None else format.format(value)
+
+
+def Report(name, parts, result, baseline):
+
+    if "error" in result:
+        print("{0:<42} {1:>6}  error: {2}".format(name, parts, result["error"]))
+        return
+
+    line = "{0:<42} {1:>6} {2:>6} {3:>10} {4:>10} {5:>12} {6:>10}".format(
+        name, parts, result["runs"], Format(result["p50"] * 1000, "{0:.3f}"), Format(result["p99"] * 1000, "{0:.3f}"),
+        Format(result["throughput"], "{0:.0f}"), Format(result["peakKb"], "{0:.0f}"))
+
+    previous = baseline.get(Key(name, parts)) if baseline else None
+    if previous is not None and "p50" in previous and previous["p50"] > 0:
+        line += " {0:>+8.1%}".format(result["p50"] / previous["p50"] - 1)
+    print(line)
+
+
+def Key(name, parts):
+    return "{0}|{1}".format(name, parts)
+
+
+def LoadBaseline(name):
+    with open(os.path.join(baselineDirectory, name + ".json")) as f:
+        return json.load(f)["results"]
+
+
+def SaveBaseline(name, results):
+
+    if not os.path.isdir(baselineDirectory):
+        os.makedirs(baselineDirectory)
+
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    path = os.path.join(baselineDirectory, name + ".json")
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    print("baseline saved to " + path)
+
+
+def Regressions(results, baseline, threshold):
+    ''' Keys of cases whose p50 is more than threshold (fraction) slower than the baseline '''
+
+    regressions = []
+    for key, result in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None or "p50" not in result or "p50" not in previous:
+            continue
+        if result["p50"] > previous["p50"] * (1 + threshold):
+            regressions.append(key)
+    return regressions
+
+
+def ParseArguments(arguments):
+
+    parser = argparse.ArgumentParser(description="C4C module benchmarks")
+    parser.add_argument("--sizes", default="1,10,100,1000,5000", help="comma separated amounts of parts (default: %(default)s)")
+    parser.add_argument("--cases", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--runs", type=int, default=5, help="minimum runs per case (default: %(default)s)")
+    parser.add_argument("--max-runs", dest="maxRuns", type=int, default=1000, help="maximum runs per case (default: %(default)s)")
+    parser.add_argument("--seconds", type=float, default=1.0, help="minimum seconds per case (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake server latency in seconds (default: %(default)s)")
+    parser.add_argument("--payload", type=int, default=256, help="bytes of padding per entity (default: %(default)s)")
+    parser.add_argument("--page-size", dest="pageSize", type=int, default=100, help="fake server page size (default: %(default)s)")
+    parser.add_argument("--compression", action="store_true", help="request gzip responses from the fake server")
+    parser.add_argument("--compress-above", dest="compressAbove", type=int, help="gzip request bodies from this amount of bytes")
+    parser.add_argument("--imports", type=int, default=5, help="fresh interpreters per import measurement, 0 to skip (default: %(default)s)")
+    parser.add_argument("--no-server", dest="server", action="store_false", help="skip the end-to-end cases")
+    parser.add_argument("--save", help="store the results as baseline with this name")
+    parser.add_argument("--compare", help="compare with the baseline with this name")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 slowdown reported as regression (default: %(default)s)")
+    return parser.parse_args(arguments)
+
+
+def Main(arguments):
+
+    options = ParseArguments(arguments)
+    sizes = [int(size) for size in options.sizes.split(",") if size.strip()]
+    baseline = LoadBaseline(options.compare) if options.compare else None
+
+    server = FakeC4C(latency=options.latency, payloadSize=options.payload, pageSize=options.pageSize).Start() if options.server else None
+    context = Context(options, server)
+
+    print("python {0} on {1}, peak memory {2}".format(platform.python_version(), platform.platform(),
+                                                      "in KiB (tracemalloc)" if tracemalloc else "not available (python 3 only)"))
+    print("{0:<42} {1:>6} {2:>6} {3:>10} {4:>10} {5:>12} {6:>10}{7}".format(
+        "case", "parts", "runs", "p50 ms", "p99 ms", "parts/s", "peak KiB", "   vs base" if baseline else ""))
+
+    results = {}
+    for module, shim in imports:
+        name = "import " + module
+        if options.imports <= 0 or options.cases not in name:
+            continue
+        try:
+            result = MeasureImport(module, shim, options.imports)
+        except Exception as e:
+            result = {"error": "{0}: {1}".format(type(e).__name__, e)}
+        results[Key(name, 1)] = result
+        Report(name, 1, result, baseline)
+
+    try:
+        for name, case, needsServer in cases:
+            if options.cases not in name or (needsServer and server is None):
+                continue
+            for parts in sizes:
+                try:
+                    result = Measure(case(parts, context), parts, options)
+                except Exception as e:
+                    result = {"error": "{0}: {1}".format(type(e).__name__, e)}
+                results[Key(name, parts)] = result
+                Report(name, parts, result, baseline)
+    finally:
+        if server is not None:
+            server.Stop()
+
+    if server is not None:
+        print("fake c4c: " + ", ".join("{0}={1}".format(key, value) for key, value in sorted(server.stats.items())))
+        stats = context.transport.GetStats()
+        print("transport: sent {0} bytes ({1} uncompressed), received {2} bytes ({3} uncompressed)".format(
+            stats["bytesSent"], stats["bytesSentUncompressed"], stats["bytesReceived"], stats["bytesReceivedUncompressed"]))
+
+    if options.save:
+        SaveBaseline(options.save, results)
+
+    if baseline is not None:
+        regressions = Regressions(results, baseline, options.threshold)
+        for key in regressions:
+            print("REGRESSION " + key)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+'''
+    Tests for the histograms of C4C_Instrumentation, run on CPython (python 2.7 & 3) without the CLR
+
+    > python -m pytest tests
+    > python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from C4C_Instrumentation import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles_are_interpolated(self):
+        histogram = Histogram()
+        for i in range(1, 1001):
+            histogram.Add(i / 1000.0)
+
+        self.assertAlmostEqual(histogram.Percentile(50), 0.5, delta=0.01)
+        self.assertAlmostEqual(histogram.Percentile(99), 0.99, delta=0.01)
+        self.assertEqual(histogram.Percentile(100), 1.0)
+
+    def test_constant_values(self):
+        histogram = Histogram()
+        for _ in range(10):
+            histogram.Add(0.3)
+
+        self.assertEqual(histogram.Summary()["p50"], 0.3)
+        self.assertEqual(histogram.Summary()["p99"], 0.3)
+
+    def test_zero_and_empty(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.Percentile(50), 0.0)
+
+        histogram.Add(0)
+        histogram.Add(0)
+        histogram.Add(8)
+        self.assertEqual(histogram.Percentile(50), 0.0)
+        self.assertEqual(histogram.Percentile(100), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,378 @@
+'''
+    Tests for C4C_Odata with a stub transport, run on CPython (python 2.7 & 3)
+    using the CLR stand-ins of the benchmarks (benchmarks/clr_shim.py)
+
+    > python -m pytest tests
+    > python -m unittest discover tests
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+import clr_shim
+clr_shim.install()
+
+from C4C_Odata import Odata, OdataChangeset, OdataInFlight, OdataRateLimiter, OdataRequest, OdataResponseCache
+from C4C_OdataCore import OdataBatchReader
+from Objects import Objects
+from System.Net import WebException
+
+
+class Config(object):
+    ''' config stand-in, config.environment holds the Odata settings '''
+
+    def __init__(self, **settings):
+        self.environment = self
+        self.OdataServiceUsername = "test"
+        self.OdataServicePassword = "test"
+        self.SAPID = "000000"
+        self.OdataServiceUrl = "https://c4c.test/odata/"
+        self.WebServiceTrafficLogging = False
+        self.OdataMethod = "Sync"
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+
+def Response(statusCode, body="", headers=None):
+
+    response = Objects.Dynamic()
+    response.StatusCode = statusCode
+    response.Headers = headers or {}
+    response.Body = body
+    response.Error = WebException("{0} error".format(statusCode), response) if statusCode >= 400 else None
+    return response
+
+
+def Answer(method, url, body):
+    ''' default answer of StubTransport: (status, body) '''
+
+    if method == "GET":
+        return (200, '{"d": {"results": [{"Url": "' + url + '"}]}}')
+    return (201, '{"d": {}}') if method == "POST" else (204, "")
+
+
+class StubTransport:
+    '''
+        Send stand-in answering every request with answer(method, url, body) -> (status, body)
+        $batch requests are answered part by part, a changeset with a failing request fails as a whole (as c4c does)
+    '''
+
+    def __init__(self, answer=Answer, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.requests = []  # (method, relative url, body) in order of arrival, $batch parts included
+        self.active = 0
+        self.maxActive = 0  # peak amount of concurrent requests
+        self._lock = threading.Lock()
+
+    def Send(self, method, url, headers, body=None):
+
+        if method == "HEAD":
+            return Response(200, "", {"x-csrf-token": "token"})
+
+        url = url.split("/odata/", 1)[1]
+        with self._lock:
+            self.requests.append((method, url, body))
+            self.active += 1
+            self.maxActive = max(self.maxActive, self.active)
+        try:
+            time.sleep(self.delay)
+            if url == "$batch":
+                return Response(202, self._AnswerBatch(body))
+            status, responseBody = self.answer(method, url, body)
+            return Response(status, responseBody)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def _AnswerBatch(self, body):
+
+        parts = []
+        for part in OdataBatchReader(body).Parts():
+            if isinstance(part, list):
+                answers = [self._AnswerPart(changeRequest) for changeRequest in part]
+                failures = [answer for answer in answers if answer[0] >= 400]
+                parts.append(failures[0] if failures else ("changeset", answers))
+            else:
+                parts.append(self._AnswerPart(part))
+        return BatchResponse("batchresponse", parts)
+
+    def _AnswerPart(self, part):
+
+        method, url = part.StatusLine.split(" ")[:2]
+        with self._lock:
+            self.requests.append((method, url, part.RawBody))
+        return self.answer(method, url, part.RawBody)
+
+
+def BatchResponse(boundary, parts):
+    ''' multipart response, parts are (status, body) or ("changeset", parts) '''
+
+    lines = []
+    for status, body in parts:
+        lines.append("--" + boundary)
+        if status == "changeset":
+            lines.extend(["Content-Type: multipart/mixed; boundary=changeset", "", BatchResponse("changeset", body)])
+        else:
+            lines.extend(["Content-Type: application/http", "Content-Transfer-Encoding: binary", "",
+                          "HTTP/1.1 {0} Status\r\nContent-Type: application/json\r\n\r\n{1}".format(status, body)])
+    lines.append("--" + boundary + "--")
+    return "\r\n".join(lines)
+
+
+class BlockingAnswer:
+    ''' answer holding GET requests until released, Started is set once a GET arrived '''
+
+    def __init__(self):
+        self.Started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, method, url, body):
+        if method == "GET":
+            self.Started.set()
+            self.release.wait(5)
+        return Answer(method, url, body)
+
+    def Release(self):
+        self.release.set()
+
+
+def InThread(function):
+    ''' start function in a thread, returns a function joining it and returning the result '''
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+
+    def join():
+        thread.join(5)
+        return result[0]
+    return join
+
+
+def WaitFor(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+
+
+def Gets(transport):
+    return [url for method, url, _ in transport.requests if method == "GET"]
+
+
+def Get(url="AccountCollection", **query):
+    return OdataRequest(OdataRequest.Method.GET, url, query)
+
+
+def Patch(url):
+    return OdataRequest(OdataRequest.Method.PATCH, url, body='{"Name": "a"}')
+
+
+def Post(url, contentId=None):
+    return OdataRequest(OdataRequest.Method.POST, url, contentId=contentId, body='{"Name": "a"}')
+
+
+def Batches(transport):
+    ''' urls of the parts per $batch request '''
+
+    batches = []
+    for method, url, _ in transport.requests:
+        if url == "$batch":
+            batches.append([])
+        elif batches:
+            batches[-1].append(url)
+    return batches
+
+
+class ExecuteBatchTest(unittest.TestCase):
+
+    def test_async_wire_batches_are_sent_in_order(self):
+        transport = StubTransport(delay=0.05)
+        odata = Odata(Config(OdataMethod="Async", OdataBatchMaxParts=1), transport=transport)
+        requests = [Get(), OdataChangeset([Patch("AccountCollection('1')")]), Get("ContactCollection")]
+
+        pending, complete = odata.ExecuteBatch(requests)
+        responses = Odata.Await(pending, [complete])
+
+        self.assertEqual(transport.maxActive, 1)
+        self.assertEqual([url for method, url, _ in transport.requests if method != "POST"],
+                         ["AccountCollection?$format=json", "AccountCollection('1')", "ContactCollection?$format=json"])
+        self.assertEqual([response.StatusCode for response in (responses[0], responses[1][0], responses[2])], [200, 204, 200])
+
+    def test_bisect_isolates_the_failing_request(self):
+        failing = "AccountCollection('3')"
+        transport = StubTransport(lambda method, url, body: (400, '{"error": {}}') if url == failing else Answer(method, url, body))
+        odata = Odata(Config(), transport=transport)
+        changeset = OdataChangeset([Patch("AccountCollection('{0}')".format(i)) for i in range(1, 5)])
+
+        responses = odata.ExecuteBatch([changeset, Get()], bisect=True)
+
+        self.assertEqual([response.StatusCode for response in responses[0]], [204, 204, 400, 204])
+        self.assertEqual(responses[1].StatusCode, 200)
+        self.assertEqual(len(Batches(transport)), 3)  # original, both halves, then the failing half split again
+
+    def test_changesets_with_references_are_not_bisected(self):
+        transport = StubTransport(lambda method, url, body: (400, '{"error": {}}') if url.startswith("$") else Answer(method, url, body))
+        odata = Odata(Config(), transport=transport)
+        changeset = OdataChangeset([Post("CorporateAccountCollection", "1"), Post("$1/CorporateAccountTeam", "2")])
+
+        responses = odata.ExecuteBatch([changeset], bisect=True)
+
+        self.assertEqual(responses[0].StatusCode, 400)
+        self.assertEqual(len(Batches(transport)), 1)
+
+
+class ThrottlingTest(unittest.TestCase):
+
+    def test_throttled_requests_are_retried(self):
+        answers = [(429, ""), (200, '{"d": {"results": []}}')]
+        transport = StubTransport(lambda method, url, body: answers.pop(0))
+        odata = Odata(Config(OdataMaxRetries=2, OdataRetryBaseDelay=0.001), transport=transport)
+
+        self.assertEqual(odata.Execute(Get("OpportunityCollection")), [])
+        self.assertEqual(len(Gets(transport)), 2)
+
+    def test_rate_limiter_halves_the_rate_and_pauses_on_throttling(self):
+        limiter = OdataRateLimiter(10)
+        limiter.Acquire()
+
+        limiter.Observe("AccountCollection", 429, 0.1, retryAfter=0.05)
+        waited = limiter.Acquire()
+
+        self.assertEqual(limiter.GetStats()["rate"], 5.0)
+        self.assertGreaterEqual(waited, 0.04)
+
+    def test_rate_limiter_reduces_the_rate_when_slow(self):
+        limiter = OdataRateLimiter(10)
+        for _ in range(5):
+            limiter.Observe("AccountCollection", 200, 0.1)
+        rate = limiter.GetStats()["rate"]
+        for _ in range(5):
+            limiter.Observe("AccountCollection", 200, 2.0)
+
+        self.assertGreater(rate, 10)
+        self.assertLess(limiter.GetStats()["rate"], rate)
+        self.assertGreater(limiter.GetStats()["slow"], 0)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_key_encodes_query_values(self):
+        self.assertNotEqual(OdataResponseCache.GetKey(Get(a="1&b=2")), OdataResponseCache.GetKey(Get(a="1", b="2")))
+
+    def test_async_hits_return_the_parsed_result(self):
+        transport = StubTransport()
+        odata = Odata(Config(OdataMethod="Async", OdataResponseCacheTtl=60), transport=transport, responseCache=OdataResponseCache())
+
+        task, parse = odata.Execute(Get())
+        first = Odata.Await(task, [parse])
+        task, parse = odata.Execute(Get())
+
+        self.assertIs(Odata.Await(task, [parse]), first)
+        self.assertEqual(len(Gets(transport)), 1)
+        self.assertEqual(odata.responseCache.GetStats()["hits"], 1)
+
+    def test_get_started_before_a_write_is_not_stored(self):
+        answer = BlockingAnswer()
+        transport = StubTransport(answer)
+        odata = Odata(Config(OdataResponseCacheTtl=60), transport=transport, responseCache=OdataResponseCache())
+
+        join = InThread(lambda: odata.Execute(Get()))
+        answer.Started.wait(5)
+        odata.Execute(Patch("AccountCollection('1')"))
+        answer.Release()
+        join()
+
+        self.assertEqual(odata.responseCache.GetStats()["entries"], 0)
+        odata.Execute(Get())
+        self.assertEqual(len(Gets(transport)), 2)
+        self.assertEqual(odata.responseCache.GetStats()["entries"], 1)
+
+
+class InFlightTest(unittest.TestCase):
+
+    def test_coalesces_only_while_in_flight(self):
+        answer = BlockingAnswer()
+        transport = StubTransport(answer)
+        odata = Odata(Config(), transport=transport)
+        coalesced = OdataInFlight.GetStats()["coalesced"]
+
+        first = InThread(lambda: odata.Execute(Get("ContactCollection")))
+        answer.Started.wait(5)
+        second = InThread(lambda: odata.Execute(Get("ContactCollection")))
+        WaitFor(lambda: OdataInFlight.GetStats()["coalesced"] > coalesced)
+        answer.Release()
+
+        self.assertEqual(first(), second())
+        self.assertIsNot(first(), second())  # the body is shared, parsed results are not
+        self.assertEqual(len(Gets(transport)), 1)
+
+        odata.Execute(Get("ContactCollection"))
+        self.assertEqual(len(Gets(transport)), 2)
+
+    def test_get_after_a_write_does_not_join_earlier_flight(self):
+        answer = BlockingAnswer()
+        transport = StubTransport(answer)
+        odata = Odata(Config(), transport=transport)
+
+        first = InThread(lambda: odata.Execute(Get("LeadCollection")))
+        answer.Started.wait(5)
+        odata.Execute(Patch("LeadCollection('1')"))
+        second = InThread(lambda: odata.Execute(Get("LeadCollection")))
+        WaitFor(lambda: len(Gets(transport)) == 2)
+        answer.Release()
+        first(), second()
+
+        self.assertEqual(len(Gets(transport)), 2)
+        self.assertEqual(OdataInFlight.GetStats()["inFlight"], 0)
+
+
+class QueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = StubTransport()
+        self.odata = Odata(Config(), transport=self.transport)
+
+    def test_content_ids_and_references_across_a_full_buffer(self):
+        with self.odata.Queue(maxSize=2) as queue:
+            account = queue.Add(Post("CorporateAccountCollection", contentId="2"))
+            contact = queue.Add(Post("ContactCollection"))
+            team = queue.Add(Post("$2/CorporateAccountTeam"))  # stays with its target, the buffer grows beyond maxSize
+            self.assertEqual((account.ContentId, contact.ContentId, team.ContentId), ("2", "3", "4"))
+            self.assertFalse(team.Done)
+
+            other = queue.Add(Post("CorporateAccountCollection"))  # the full buffer is flushed first
+            self.assertTrue(team.Done)
+            self.assertEqual(other.ContentId, "1")
+
+        self.assertEqual(Batches(self.transport), [["CorporateAccountCollection", "ContactCollection", "$2/CorporateAccountTeam"],
+                                                   ["CorporateAccountCollection"]])
+        self.assertEqual([Odata.Await(future).StatusCode for future in (account, contact, team, other)], [201, 201, 201, 201])
+
+    def test_duplicate_content_id_raises(self):
+        with self.odata.Queue() as queue:
+            queue.Add(Post("CorporateAccountCollection", contentId="1"))
+            with self.assertRaises(ValueError):
+                queue.Add(Post("ContactCollection", contentId="1"))
+
+    def test_reference_to_unbuffered_request_raises(self):
+        with self.odata.Queue() as queue:
+            account = queue.Add(Post("CorporateAccountCollection"))
+            queue.Flush()
+            with self.assertRaises(ValueError):
+                queue.Add(Post("$" + account.ContentId + "/CorporateAccountTeam"))
+            with self.assertRaises(ValueError):
+                queue.Add(Post("$9/CorporateAccountTeam"))
+
+        self.assertEqual(Batches(self.transport), [["CorporateAccountCollection"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
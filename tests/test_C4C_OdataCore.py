@@ -0,0 +1,168 @@
+'''
+    Tests for the dependency free core of C4C_Odata, run on CPython (python 2.7 & 3) without the CLR
+
+    > python -m pytest tests
+    > python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from C4C_OdataCore import OdataBatchReader, OdataBatchWriter, OdataChangeset, OdataJson, OdataRequest, OdataResponsePart, UrlEncode
+
+
+def BatchResponse(boundary, parts):
+    ''' multipart response with \r\n line endings, parts are strings or (boundary, parts) tuples for changesets '''
+
+    lines = []
+    for part in parts:
+        lines.append("--" + boundary)
+        if isinstance(part, tuple):
+            lines.extend(["Content-Type: multipart/mixed; boundary=" + part[0], "", BatchResponse(part[0], part[1])])
+        else:
+            lines.extend(["Content-Type: application/http", "Content-Transfer-Encoding: binary", "", part])
+    lines.append("--" + boundary + "--")
+    return "\r\n".join(lines)
+
+
+def Query(url):
+    ''' query parameters of a relative url, in any order '''
+
+    return set(url.split("?")[1].split("&"))
+
+
+class UrlEncodeTest(unittest.TestCase):
+
+    def test_matches_http_utility(self):
+        self.assertEqual(UrlEncode("Name eq 'a b'"), "Name+eq+%27a+b%27")
+        self.assertEqual(UrlEncode("ObjectID,ID-_.!*()"), "ObjectID%2cID-_.!*()")
+        self.assertEqual(UrlEncode(u"\u00fc~/"), "%c3%bc%7e%2f")
+        self.assertEqual(UrlEncode(10), "10")
+
+
+class OdataRequestTest(unittest.TestCase):
+
+    def test_get_defaults_to_json(self):
+        request = OdataRequest(OdataRequest.Method.GET, "QuoteCollection", {"top": "1"})
+        self.assertEqual(request.getUrl(), "QuoteCollection?$top=1&$format=json")
+        self.assertEqual(request.query, {"top": "1"})
+
+    def test_query_changed_in_place(self):
+        request = OdataRequest(OdataRequest.Method.GET, "QuoteCollection", {"top": "10"})
+        request.getUrl()
+        request.query["skip"] = "100"
+        self.assertEqual(Query(request.getUrl()), set(["$top=10", "$skip=100", "$format=json"]))
+
+    def test_with_query_keeps_original(self):
+        request = OdataRequest(OdataRequest.Method.GET, "QuoteCollection", {"top": "10"})
+        variant = request.withQuery(skip="20")
+        self.assertEqual(Query(variant.getUrl()), set(["$top=10", "$skip=20", "$format=json"]))
+        self.assertEqual(request.getUrl(), "QuoteCollection?$top=10&$format=json")
+
+    def test_with_body_has_its_own_query(self):
+        request = OdataRequest(OdataRequest.Method.PATCH, "QuoteCollection('1')", {"x": "1"}, body="{}")
+        variant = request.withBody('{"Name": "a"}')
+        variant.query["y"] = "2"
+        self.assertEqual(request.query, {"x": "1"})
+        self.assertEqual(request.getUrl(), "QuoteCollection('1')?$x=1")
+
+    def test_headers_follow_attributes(self):
+        request = OdataRequest(OdataRequest.Method.PATCH, "QuoteCollection('1')", body='{"Name":"a"}')
+        self.assertEqual(str(request), "PATCH QuoteCollection('1') HTTP/1.1\nContent-Type: application/json\nContent-Length: 12\n"
+                                       "Accept: application/json\n\n" + '{"Name":"a"}')
+        request.contentId = "1"
+        self.assertIn("\nContent-ID: 1\n", str(request))
+
+    def test_content_length_counts_bytes(self):
+        request = OdataRequest(OdataRequest.Method.PATCH, "QuoteCollection('1')", body=u'{"Name":"\u00e9"}')
+        self.assertIn("\nContent-Length: 13", request._getHeaders())
+
+
+class OdataBatchTest(unittest.TestCase):
+
+    def test_writer_reader_round_trip(self):
+        ''' the reader parses the request parts written by the writer, changesets included '''
+
+        get = OdataRequest(OdataRequest.Method.GET, "QuoteCollection", {"top": "1"})
+        patch = OdataRequest(OdataRequest.Method.PATCH, "QuoteCollection('1')", contentId="1", body='{"Name": "a: b"}')
+        delete = OdataRequest(OdataRequest.Method.DELETE, "QuoteCollection('2')", contentId="2")
+        body, _ = OdataBatchWriter.Combine("batch", [get, OdataChangeset([patch, delete])])
+
+        parts = list(OdataBatchReader(body).Parts())
+
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].StatusLine, "GET QuoteCollection?$top=1&$format=json HTTP/1.1")
+        self.assertEqual([part.StatusLine for part in parts[1]], ["PATCH QuoteCollection('1') HTTP/1.1", "DELETE QuoteCollection('2') HTTP/1.1"])
+        self.assertEqual(parts[1][0].RawBody, '{"Name": "a: b"}')
+        self.assertEqual([(h.Name, h.Value) for h in parts[1][0].Headers if h.Name == "Content-ID"], [("Content-ID", "1")])
+
+    def test_nested_changesets_and_headers(self):
+        response = BatchResponse("batchresponse_1", [
+            "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nLocation: https://host/QuoteCollection('1')\r\n\r\n"
+            '{"d": {"results": [{"ID": "1"}]}}',
+            ("changesetresponse_2", [
+                "HTTP/1.1 201 Created\r\nContent-Type: application/json\r\nX-Note: a: b\r\n\r\n{\"d\": {\"ID\": \"2\"}}",
+                "HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n",
+            ]),
+            "HTTP/1.1 404 Not Found\r\nContent-Type: application/json\r\n\r\n{\"error\": {\"code\": \"404\"}}",
+        ])
+
+        parts = list(OdataBatchReader(response).Parts())
+
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(parts[0].StatusCode, 200)
+        self.assertEqual(parts[0].Headers[1].Value, "https://host/QuoteCollection('1')")
+        self.assertEqual(parts[0].Body[0].ID, "1")
+        created, noContent = parts[1]
+        self.assertEqual((created.StatusCode, created.Headers[1].Name, created.Headers[1].Value), (201, "X-Note", "a: b"))
+        self.assertEqual(created.Body.ID, "2")
+        self.assertEqual(noContent.StatusCode, 204)
+        self.assertIsNone(noContent.Body)
+        self.assertEqual(parts[2].StatusCode, 404)
+
+    def test_body_filter_skips_bodies(self):
+        response = BatchResponse("b", ["HTTP/1.1 201 Created\r\n\r\n{\"d\": {}}", "HTTP/1.1 200 OK\r\n\r\n{\"d\": {\"ID\": \"1\"}}"])
+
+        parts = list(OdataBatchReader(response, OdataResponsePart.ExcludeStatus(201)).Parts())
+
+        self.assertIsNone(parts[0].RawBody)
+        self.assertEqual(parts[1].Body.ID, "1")
+
+    def test_reads_file_objects(self):
+        import io
+
+        response = BatchResponse("b", ["HTTP/1.1 204 No Content\r\n\r\n"])
+        parts = list(OdataBatchReader(io.StringIO(u"" + response)).Parts())
+        self.assertEqual([part.StatusCode for part in parts], [204])
+
+    def test_split_keeps_changesets_together(self):
+        changeset = OdataChangeset([OdataRequest(OdataRequest.Method.PATCH, "A('{0}')".format(i), body="{}") for i in range(3)])
+        get = OdataRequest(OdataRequest.Method.GET, "A")
+
+        batches = OdataBatchWriter(maxParts=3).Split([get, changeset, get])
+
+        self.assertEqual([requests for requests, _ in batches], [[get], [changeset], [get]])
+
+
+class OdataJsonTest(unittest.TestCase):
+
+    def test_unwraps_results(self):
+        self.assertEqual(OdataJson.Parse('{"d": {"results": [{"ID": "1"}]}}')[0].ID, "1")
+        self.assertEqual(OdataJson.Parse('{"d": {"ID": "1"}}').ID, "1")
+
+    def test_page_next_link(self):
+        entities, nextLink = OdataJson.ParsePage('{"d": {"results": [], "__next": "QuoteCollection?$skiptoken=10"}}')
+        self.assertEqual((entities, nextLink), ([], "QuoteCollection?$skiptoken=10"))
+
+    def test_empty_body(self):
+        self.assertIsNone(OdataJson.Parse(""))
+        self.assertIsNone(OdataJson.Parse(" \r\n"))
+        self.assertIsNone(OdataJson.Parse(None))
+        self.assertEqual(OdataJson.ParsePage(""), ([], None))
+
+
+if __name__ == "__main__":
+    unittest.main()
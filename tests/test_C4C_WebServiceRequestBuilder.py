@@ -0,0 +1,77 @@
+'''
+    Tests for the message building of C4C_WebServiceRequestBuilder, run on CPython (python 2.7 & 3)
+    using the CLR stand-ins of the benchmarks (benchmarks/clr_shim.py, benchmarks/fake_soap.py)
+
+    > python -m pytest tests
+    > python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+import clr_shim
+clr_shim.install()
+
+import fake_soap
+from C4C_WebServiceRequestBuilder import WebServiceRequestBuilder
+
+
+def Fields(value):
+    ''' comparable python structure of a built message '''
+
+    if isinstance(value, list):
+        return [Fields(item) for item in value]
+    if isinstance(value, clr_shim.ClrObject):
+        return (type(value).__name__, dict((name, Fields(field)) for name, field in vars(value).items()))
+    return value
+
+
+def Order(name=None, items=()):
+    order = {"BuyerID": "CPQ-1", "Item": [{"SalesOrderItem": item} for item in items]}
+    if name is not None:
+        order["Name"] = name
+    return {"SalesOrderMaintainRequestBundleMessage": {"SalesOrder": [{"SalesOrder": order}]}}
+
+
+class WebServiceMessagePlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = fake_soap.SalesOrderMaintainService()
+
+    def assertSameAsProcessMessage(self, plan, message):
+        self.assertEqual(Fields(plan.Build(message)), Fields(WebServiceRequestBuilder.ProcessMessage(self.service, message)))
+
+    def test_same_result_as_process_message(self):
+        message = fake_soap.Message(3)
+        self.assertSameAsProcessMessage(WebServiceRequestBuilder.Compile(self.service, message), message)
+
+    def test_keys_missing_from_template(self):
+        plan = WebServiceRequestBuilder.Compile(self.service, Order(items=[{"ID": "10"}]))
+        message = Order("Quote", [{"ID": "10"}, {"ID": "20", "Description": "Second", "Quantity": {"Value": 2.0}}])
+
+        self.assertSameAsProcessMessage(plan, message)
+        order = plan.Build(message).SalesOrder[0]
+        self.assertEqual((order.Name, order.Item[1].Description, order.Item[1].Quantity.Value), ("Quote", "Second", 2.0))
+
+    def test_items_compiled_from_all_template_items(self):
+        message = Order(items=[{"ID": "10"}, {"ID": "20", "Description": "Second", "Quantity": {"Value": 2.0, "unitCode": "EA"}}])
+        plan = WebServiceRequestBuilder.Compile(self.service, message)
+
+        self.assertSameAsProcessMessage(plan, message)
+
+    def test_unknown_key_raises(self):
+        plan = WebServiceRequestBuilder.Compile(self.service, Order())
+        message = Order()
+        message["SalesOrderMaintainRequestBundleMessage"]["SalesOrder"][0]["SalesOrder"]["Unknown"] = "x"
+
+        with self.assertRaises(Exception):
+            plan.Build(message)
+
+
+if __name__ == "__main__":
+    unittest.main()